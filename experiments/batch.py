@@ -59,60 +59,53 @@ def simulate(tocssp, tocpath, pi, printTrajectory=False):
     travelTime = 0.0
     s = tocssp.s0
 
-    while tocssp.states[s][0] != tocpath.vg and len(autonomousCounter) < maxIterations:
-        v, bfa = tocssp.states[s]
+    # Follow the dense vertex indexes of the states, using the UIDs only to print.
+    vertexes = tocssp.stateVertexes
+    vg = tocpath.VIndex[tocpath.vg]
+
+    while vertexes[s] != vg and len(autonomousCounter) < maxIterations:
+        v = vertexes[s]
+        bfa = tocssp.states[s][1]
 
         if printTrajectory:
-            print("State: %i (%s, %s)" % (s, v, bfa))
+            print("State: %i (%s, %s)" % (s, tocssp.states[s][0], bfa))
 
         # Randomly transition to a new state following the state transition function.
-        targetValue = rnd.random()
-        currentValue = 0.0
-        sp = tocssp.S[s * tocssp.m * tocssp.ns + pi[s] * tocssp.ns + 0]
-
-        for i in range(tocssp.ns):
-            spPotential = tocssp.S[s * tocssp.m * tocssp.ns + pi[s] * tocssp.ns + i]
-            if spPotential < 0:
-                break
-
-            currentValue += tocssp.T[s * tocssp.m * tocssp.ns + pi[s] * tocssp.ns + i]
-            if currentValue >= targetValue:
-                sp = spPotential
-                break
+        i = sample_cumulative(tocssp.transition_cumulative()[s, pi[s]], rnd.random())
+        sp = tocssp.S[s * tocssp.m * tocssp.ns + pi[s] * tocssp.ns + i]
 
         if printTrajectory:
             print("Action: %i %s" % (pi[s], tocssp.actions[pi[s]]))
 
         # The last transision from s to sp at an absorbing state has no extra properties
         # in terms of time or autonomy. Skip it.
-        if tocssp.states[sp][0] != tocpath.vg:
+        if vertexes[sp] != vg:
             # Increment the autonomy counter and travel time. Note that we count it if
             # the autonomous driving was done on *this* state, since it is assumed that
             # transfer of control will occur near end of the edge itself (if at all).
-            vp, bfap = tocssp.states[sp]
-            e = (v, vp)
+            slot = tocpath.edge_slot(v, vertexes[sp])
 
             if printTrajectory:
-                print("State Prime: %i (%s, %s)" % (sp, vp, bfap))
+                print("State Prime: %i (%s, %s)" % (sp, tocssp.states[sp][0], tocssp.states[sp][1]))
 
-            autonomousCounter += [bfa == "vehicle" and e in tocpath.Ep]
+            autonomousCounter += [bfa == "vehicle" and slot >= 0 and bool(tocpath.preferred[slot])]
 
             # Add to the travel time. Also, handle the special case in which ToC Failed.
             # This, as per the definition, assumes that the maximal amount of time is
             # spent waiting to try ToC again. Sometimes there are self-loops in roads,
-            # so the edge will exist in w. When the edge does not exist, that is when
+            # so the edge will exist. When the edge does not exist, that is when
             # we have s == sp at a normal road.
-            try:
-                travelTime += tocpath.w[e]
-            except KeyError:
-                travelTime += max([time for edge, time in tocpath.w.items()])
+            if slot >= 0:
+                travelTime += tocpath.weights[slot]
+            else:
+                travelTime += tocpath.weights.max()
         else:
             if printTrajectory:
                 print("State Prime: %i (%s)" % (sp, tocssp.states[sp]))
 
         s = sp
 
-    isGoalReachable = (tocssp.states[s][0] == tocpath.vg)
+    isGoalReachable = (vertexes[s] == vg)
 
     percentageAutonomous = (tocssp.states[tocssp.s0][1] == "vehicle")
     if len(autonomousCounter) > 0:
@@ -139,6 +132,13 @@ cities = [("Austin", "maps/austin/austin.osm", 152702349, 282401347),
 resultsFilename = os.path.join(thisFilePath, "..", "results", "results_" + str(int(round(time.time() * 1000))) + ".csv")
 numTrials = 100
 
+# The ToC POMDP policies are identical for every city (and run), so solve each once.
+cacheDirectory = os.path.join(thisFilePath, "cache")
+
+# Optionally, only build the ToC SSP over the vertexes within this factor of the shortest
+# path's cost from the start to the goal. None uses the entire map.
+detourFactor = None
+
 
 def batch():
     """ Execute a batch run for each city, and each configuration, then save the results to a file. """
@@ -160,6 +160,8 @@ def batch():
     toc = (tocHuman, tocVehicle, tocSideOfRoad)
     tocpomdp = (tocpomdpHuman, tocpomdpVehicle, tocpomdpSideOfRoad)
 
+    cache = ToCCache(directory=cacheDirectory)
+
     for city, filename, startVertex, goalVertex in cities:
         print("Experiment '%s'" % (city), end='')
         sys.stdout.flush()
@@ -170,6 +172,9 @@ def batch():
         tocpath.v0 = startVertex
         tocpath.vg = goalVertex
 
+        if detourFactor is not None:
+            tocpath = tocpath.corridor(detourFactor)
+
         # We record: 1) percentage of times it reached the goal, 2) percentage of time it was
         # autonomous, and 3) total travel time, for each of the three scenarios.
         isGoalReachable = {'h': None, 'v': None, 'h+v': None}
@@ -178,7 +183,7 @@ def batch():
 
         # Step 1: Construct the ToCSSP with just a human controller.
         tocssp = ToCSSP()
-        tocssp.create(toc, tocpomdp, tocpath, controller="human")
+        tocssp.create(toc, tocpomdp, tocpath, controller="human", cache=cache)
         V, pi, timing = tocssp.solve(algorithm='lao*', process='cpu')
         #V, pi, timing = tocssp.solve(algorithm='vi', process='gpu')
 
@@ -189,7 +194,7 @@ def batch():
 
         # Step 2: Construct the ToCSSP with just a vehicle controller.
         tocssp = ToCSSP()
-        tocssp.create(toc, tocpomdp, tocpath, controller="vehicle")
+        tocssp.create(toc, tocpomdp, tocpath, controller="vehicle", cache=cache)
         V, pi, timing = tocssp.solve(algorithm='lao*', process='cpu')
         #V, pi, timing = tocssp.solve(algorithm='vi', process='gpu')
 
@@ -200,7 +205,7 @@ def batch():
 
         # Step 3: Construct the ToCSSP with both a human and vehicle controller.
         tocssp = ToCSSP()
-        tocssp.create(toc, tocpomdp, tocpath, controller=None)
+        tocssp.create(toc, tocpomdp, tocpath, controller=None, cache=cache)
         V, pi, timing = tocssp.solve(algorithm='lao*', process='cpu')
         #V, pi, timing = tocssp.solve(algorithm='vi', process='gpu')
 
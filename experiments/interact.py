@@ -153,8 +153,8 @@ class Interact(object):
         self.observation = None
         self.observationIndex = None
 
-        validInitialStates = [self.tocpomdp.states.index((len(self.toc.T) - 1, h, "nop", 0)) for h in self.toc.H]
-        self.b = np.array([1.0 / len(validInitialStates) * (i in validInitialStates) for i in range(self.tocpomdp.n)])
+        validInitialStates = [self.tocpomdp.statesIndex[(len(self.toc.T) - 1, h, "nop", 0)] for h in self.toc.H]
+        self.b = ToCBelief(sorted(validInitialStates), [1.0 / len(validInitialStates) for s in validInitialStates])
 
         self._update_belief_factors()
 
@@ -426,10 +426,10 @@ class Interact(object):
             # within the model, even though it is possible after 111 years, technically. So, we handle
             # this case by using the observation to assign the belief.
             try:
-                self.b = update_belief(self.tocpomdp, self.b, self.actionIndex, self.observationIndex)
+                self.b = update_factored_belief(self.tocpomdp, self.b, self.actionIndex, self.observationIndex)
             except Exception:
                 if self.observation in self.calE:
-                    self.b = np.array([1.0 * (s == self.observation) for s in self.tocpomdp.states])
+                    self.b = ToCBelief([self.tocpomdp.statesIndex[self.observation]], [1.0])
                 else:
                     raise Exception()
 
@@ -443,11 +443,11 @@ class Interact(object):
         elif self.beliefFactorEndResultState is not None:
             print("End Result State:               %s" % (self.beliefFactorEndResultState))
 
-        #print("Belief:             %s" % (str(["%s: %.2f" % (str(self.tocpomdp.states[i]), self.b[i]) \
-        #                                        for i in range(self.tocpomdp.n) if self.b[i] > 0.0])))
+        #print("Belief:             %s" % (str(["%s: %.2f" % (str(self.tocpomdp.states[s]), b) \
+        #                                        for s, b in zip(self.b.states, self.b.values) if b > 0.0])))
 
         # With the potential new information from the observation, we take an action.
-        self.actionIndex, v = take_action(self.tocpomdp, self.Gamma, self.pi, self.b)
+        self.actionIndex, v = take_action_factored(self.tocpomdp, self.Gamma, self.pi, self.b)
         self.action = self.tocpomdp.actions[self.actionIndex]
 
         print("Action Taken:                   %s" % (self.action))
@@ -477,12 +477,12 @@ class Interact(object):
             else:
                 self.observation = "distracted" # self.tocpomdp.observations[1] # "distracted"
 
-        self.observationIndex = self.tocpomdp.observations.index(self.observation)
+        self.observationIndex = self.tocpomdp.observationsIndex[self.observation]
 
     def _update_belief_factors(self):
         """ Get the components (factors) of the belief state. """
 
-        nonZeroBeliefStates = [(self.tocpomdp.states[i], self.b[i]) for i in range(self.tocpomdp.n) if self.b[i] > 0.0]
+        nonZeroBeliefStates = [(self.tocpomdp.states[s], b) for s, b in zip(self.b.states, self.b.values) if b > 0.0]
 
         # Note: As proven formally, belief is only over human states. Thus, it doesn't matter which
         # non-zero belief state we pick to get the other state factor information.
@@ -75,7 +75,7 @@ def simulation(toc, tocpomdp, Gamma, pi, numIterations):
         print("Simulating Execution %i of %i." % (k + 1, numIterations))
         print("------------------------------------------------")
 
-        validInitialStates = [tocpomdp.states.index((len(toc.T) - 1, h, "nop", 0)) for h in toc.H]
+        validInitialStates = [tocpomdp.statesIndex[(len(toc.T) - 1, h, "nop", 0)] for h in toc.H]
         b = np.array([1.0 / len(validInitialStates) * (i in validInitialStates) for i in range(tocpomdp.n)])
         s = rnd.choice(validInitialStates)
 
@@ -101,16 +101,51 @@ def simulation(toc, tocpomdp, Gamma, pi, numIterations):
         print("------------------------------------------------")
 
 
+def batch_simulation(toc, tocpomdp, Gamma, pi, numIterations):
+    """ Execute many simulations of a randomized ToC POMDP in lockstep, printing only the outcomes.
+
+        Parameters:
+            toc             --  The ToC problem.
+            tocpomdp        --  The ToC POMDP.
+            Gamma           --  The policy's alpha-vectors.
+            pi              --  The policy's corresponding actions for each alpha-vector.
+            numIterations   --  The number of iterations to execute.
+    """
+
+    validInitialStates = [tocpomdp.statesIndex[(len(toc.T) - 1, h, "nop", 0)] for h in toc.H]
+    b = np.zeros(tocpomdp.n)
+    b[validInitialStates] = 1.0 / len(validInitialStates)
+
+    rng = np.random.default_rng(rnd.getrandbits(64))
+    counts = simulate_batch(tocpomdp, Gamma, pi, rng.choice(validInitialStates, size=numIterations),
+                            b, len(toc.T), rng)
+
+    print("------------------------------------------------")
+    print("Simulated %i Executions." % (numIterations))
+    print("------------------------------------------------")
+
+    for e in ["success", "failure", "aborted"]:
+        print("%-17s %i (%.3f)" % (e.capitalize() + ":", counts[tocpomdp.statesIndex[e]],
+                                   counts[tocpomdp.statesIndex[e]] / numIterations))
+
+    print("------------------------------------------------")
+
+
 if __name__ == "__main__":
     numIterations = 1
-    if len(sys.argv) == 2:
+    if len(sys.argv) >= 2:
         numIterations = int(sys.argv[1])
 
+    batch = len(sys.argv) >= 3 and sys.argv[2] == "batch"
+
     print("Executing Simulation Experiments...")
 
     toc, tocpomdp, Gamma, pi = initialize()
 
-    simulation(toc, tocpomdp, Gamma, pi, numIterations)
+    if batch:
+        batch_simulation(toc, tocpomdp, Gamma, pi, numIterations)
+    else:
+        simulation(toc, tocpomdp, Gamma, pi, numIterations)
 
     print("Done.")
 
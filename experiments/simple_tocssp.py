@@ -75,7 +75,7 @@ def save_policy_for_visualizer(tocssp, tocpath, V, pi, filename):
 
                 nextAutonomy = int(desiredActor == "vehicle" or desiredActor == "side of road")
 
-                previousVertexUIDs = [e[0] for e in tocpath.E if e[1] == currentVertexUID]
+                previousVertexUIDs = tocpath.predecessors[currentVertexUID]
 
                 for previousVertexUID in previousVertexUIDs:
                     for currentTiredness in [0, 1]:
@@ -122,7 +122,7 @@ if __name__ == "__main__":
     tocssp = ToCSSP()
     #tocssp.create(toc, tocpomdp, tocpath, controller='human')
     #tocssp.create(toc, tocpomdp, tocpath, controller='vehicle')
-    tocssp.create(toc, tocpomdp, tocpath, controller=None)
+    tocssp.create(toc, tocpomdp, tocpath, controller=None, cache=ToCCache(directory=os.path.join(thisFilePath, "cache")))
 
     print("Done.\nSolving the ToC SSP... ", end='')
     sys.stdout.flush()
@@ -139,6 +139,7 @@ if __name__ == "__main__":
 
     print(tocpath)
     print(tocssp)
+    print("Max rho 95%% confidence interval width: %.3f" % (tocssp.rhoWidth.max()))
     print(V)
     print(pi.tolist())
 
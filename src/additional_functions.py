@@ -47,16 +47,30 @@ def take_action(pomdp, Gamma, pi, b):
             bestVal     --  The best value for this best action.
     """
 
-    bestVal = np.dot(Gamma[0, :], b)
-    bestAction = pi[0]
+    values = np.asarray(Gamma).dot(b)
+    i = np.argmax(values)
 
-    for i in range(pomdp.r):
-        val = np.dot(Gamma[i, :], b)
-        if val > bestVal:
-            bestVal = val
-            bestAction = pi[i]
+    return pi[i], values[i]
 
-    return bestAction, bestVal
+
+def take_actions(pomdp, Gamma, pi, B):
+    """ Take the best action at each of a batch of belief points, e.g., for trajectories run in lockstep.
+
+        Parameters:
+            pomdp   --  The POMDP.
+            Gamma   --  The set of alpha-vectors.
+            pi      --  The corresponding actions for each alpha-vector.
+            B       --  The k-by-n array of current belief points, one per row.
+
+        Returns:
+            bestActions --  The k-array of the best action index to take at each belief point.
+            bestVals    --  The k-array of the best value for each of these best actions.
+    """
+
+    values = np.asarray(B).dot(np.asarray(Gamma).T)
+    i = np.argmax(values, axis=1)
+
+    return np.asarray(pi)[i], values[np.arange(len(i)), i]
 
 
 def transition_state(pomdp, s, a):
@@ -71,17 +85,9 @@ def transition_state(pomdp, s, a):
             The successor state index.
     """
 
-    num = rnd.random()
-    count = 0.0
+    i = sample_cumulative(pomdp.transition_cumulative()[s, a], rnd.random())
 
-    for i in range(pomdp.ns):
-        count += pomdp.T[s * pomdp.m * pomdp.ns + a * pomdp.ns + i]
-        if count >= num:
-            return pomdp.S[s * pomdp.m * pomdp.ns + a * pomdp.ns + i]
-
-    print("Warning (transition_state): The random belief is being weird...")
-
-    return pomdp.S[s * pomdp.m * pomdp.ns + a * pomdp.ns + (pomdp.ns - 1)]
+    return pomdp.S[s * pomdp.m * pomdp.ns + a * pomdp.ns + i]
 
 
 def make_observation(pomdp, a, sp):
@@ -96,17 +102,7 @@ def make_observation(pomdp, a, sp):
             The index of the observation.
     """
 
-    num = rnd.random()
-    count = 0.0
-
-    for o in range(pomdp.z):
-        count += pomdp.O[a * pomdp.n * pomdp.z + sp * pomdp.z + o]
-        if count >= num:
-            return o
-
-    print("Warning (make_observations): The random belief is being weird...")
-
-    return pomdp.z - 1
+    return sample_cumulative(pomdp.observation_cumulative()[a, sp], rnd.random())
 
 
 def update_belief(pomdp, b, a, o):
@@ -125,17 +121,8 @@ def update_belief(pomdp, b, a, o):
             Exception if the belief is invalid due to an impossible observation.
     """
 
-    bp = np.array([0.0 for i in range(pomdp.n)])
-
-    for s in range(pomdp.n):
-        for i in range(pomdp.ns):
-            sp = pomdp.S[s * pomdp.m * pomdp.ns + a * pomdp.ns + i]
-            if sp < 0:
-                break
-            bp[sp] += pomdp.T[s * pomdp.m * pomdp.ns + a * pomdp.ns + i] * b[s]
-
-    for sp in range(pomdp.n):
-        bp[sp] *= pomdp.O[a * pomdp.n * pomdp.z + sp * pomdp.z + o]
+    # This is one sparse matrix-vector product with T(., a, .) and one elementwise product with O(a, ., o).
+    bp = pomdp.transition_matrices()[a].T.dot(b) * pomdp.observation_table()[a, o]
 
     if bp.sum() == 0.0:
         raise Exception()
@@ -145,3 +132,219 @@ def update_belief(pomdp, b, a, o):
     return bp
 
 
+def simulate_batch(pomdp, Gamma, pi, initialStates, b, numSteps, rng=None):
+    """ Simulate many trajectories of the POMDP in lockstep, following the alpha-vector policy. The true
+        states are an array and the beliefs are the rows of a matrix, so each step is a handful of array
+        operations: one batched action selection, vectorized draws of successors and observations, and
+        one sparse belief update per distinct action taken.
+
+        Parameters:
+            pomdp           --  The POMDP.
+            Gamma           --  The set of alpha-vectors.
+            pi              --  The corresponding actions for each alpha-vector.
+            initialStates   --  The k-array of true initial state indexes, one per trajectory.
+            b               --  The initial belief, either one n-array for all trajectories or a k-by-n array.
+            numSteps        --  The number of steps to simulate.
+            rng             --  Optionally, the numpy.random.Generator to use. Default is None.
+
+        Returns:
+            The n-array with the number of trajectories which ended in each state.
+
+        Raises:
+            Exception if a belief is invalid due to an impossible observation.
+    """
+
+    if rng is None:
+        rng = np.random.default_rng()
+
+    s = np.array(initialStates, dtype=int)
+    k = len(s)
+
+    B = np.array(np.broadcast_to(b, (k, pomdp.n)), dtype=float)
+
+    S = as_numpy_array(pomdp.S, pomdp.n * pomdp.m * pomdp.ns).reshape(pomdp.n, pomdp.m, pomdp.ns)
+    O = pomdp.observation_table()
+
+    transitionCumulative = pomdp.transition_cumulative()
+    observationCumulative = pomdp.observation_cumulative()
+
+    for t in range(numSteps):
+        a, v = take_actions(pomdp, Gamma, pi, B)
+
+        # Sample successor states and observations from the precomputed cumulative tables.
+        sp = S[s, a, sample_cumulative(transitionCumulative[s, a], rng.random(k))]
+        o = sample_cumulative(observationCumulative[a, sp], rng.random(k))
+
+        # Update the beliefs of all trajectories that took the same action at once.
+        for action in np.unique(a):
+            rows = np.flatnonzero(a == action)
+            B[rows] = pomdp.transition_matrices()[action].T.dot(B[rows].T).T * O[action, o[rows], :]
+
+        normalizer = B.sum(axis=1)
+        if np.any(normalizer == 0.0):
+            raise Exception()
+
+        B /= normalizer[:, np.newaxis]
+        s = sp
+
+    return np.bincount(s, minlength=pomdp.n)
+
+
+def exact_outcomes(pomdp, Gamma, pi, b, numSteps, decimals=12):
+    """ Compute exactly the distribution over the states reached after following the alpha-vector policy
+        for a number of steps, starting with the true state distributed according to the initial belief.
+
+        This is a forward pass over the belief tree. Each node holds the joint probability of the true state
+        and its action-observation history, which is proportional to the node's belief. Nodes reaching the same
+        belief are merged, since the policy cannot tell them apart, so each step grows the tree by at most
+        one node per (reachable belief, observation).
+
+        Parameters:
+            pomdp       --  The POMDP.
+            Gamma       --  The set of alpha-vectors.
+            pi          --  The corresponding actions for each alpha-vector.
+            b           --  The initial belief, which is also the distribution of the true initial state.
+            numSteps    --  The number of steps to follow the policy.
+            decimals    --  Optionally, the number of decimals to which beliefs are rounded before merging.
+                            Default is 12.
+
+        Returns:
+            The n-array with the probability of ending in each state.
+    """
+
+    O = pomdp.observation_table()
+
+    # The joint probabilities, one row per reachable belief.
+    W = np.array(b, dtype=float)[np.newaxis, :]
+
+    for t in range(numSteps):
+        a, v = take_actions(pomdp, Gamma, pi, W)
+
+        children = list()
+        for action in np.unique(a):
+            Wa = pomdp.transition_matrices()[action].T.dot(W[a == action].T).T
+            children += [(Wa[:, np.newaxis, :] * O[action][np.newaxis, :, :]).reshape(-1, pomdp.n)]
+
+        W = np.concatenate(children)
+        W = W[W.sum(axis=1) > 0.0]
+
+        # Merge the nodes with equal beliefs by summing their joint probabilities.
+        B = np.round(W / W.sum(axis=1)[:, np.newaxis], decimals)
+        unique, inverse = np.unique(B, axis=0, return_inverse=True)
+
+        merged = np.zeros((len(unique), pomdp.n))
+        np.add.at(merged, inverse.ravel(), W)
+        W = merged
+
+    # Normalize away the rounding of the single precision transition and observation probabilities.
+    return W.sum(axis=0) / W.sum()
+
+
+class ToCBelief(object):
+    """ A factored belief of the ToC POMDP. Only the human state is hidden; the time remaining, last message,
+        and time since the last message follow from the action history. Thus, the belief is the indexes of
+        the (at most ns) states it supports, which share these known factors, and a vector over them.
+    """
+
+    def __init__(self, states, values):
+        """ The constructor for the ToCBelief class.
+
+            Parameters:
+                states  --  The state indexes with (possibly) non-zero belief, in increasing order. In the
+                            non-terminal case, these are the same known factors with each human state.
+                values  --  The corresponding probabilities.
+        """
+
+        self.states = np.array(states, dtype=int)
+        self.values = np.array(values, dtype=float)
+
+    def dense(self, pomdp):
+        """ Convert the factored belief to a dense belief over all the POMDP's states.
+
+            Parameters:
+                pomdp   --  The POMDP.
+
+            Returns:
+                The n-array belief.
+        """
+
+        b = np.zeros(pomdp.n)
+        b[self.states] = self.values
+
+        return b
+
+
+def factored_belief(pomdp, b):
+    """ Convert a dense belief into a factored belief.
+
+        Parameters:
+            pomdp   --  The POMDP.
+            b       --  The dense belief.
+
+        Returns:
+            The ToCBelief.
+    """
+
+    states = np.flatnonzero(np.asarray(b))
+
+    return ToCBelief(states, np.asarray(b)[states])
+
+
+def take_action_factored(pomdp, Gamma, pi, belief):
+    """ Take the best action at the current factored belief point, in O(r |H|).
+
+        Parameters:
+            pomdp   --  The POMDP.
+            Gamma   --  The set of alpha-vectors.
+            pi      --  The corresponding actions for each alpha-vector.
+            belief  --  The current ToCBelief.
+
+        Returns:
+            bestAction  --  The best action index to take at this belief point.
+            bestVal     --  The best value for this best action.
+    """
+
+    values = np.asarray(Gamma)[:, belief.states].dot(belief.values)
+    i = np.argmax(values)
+
+    return pi[i], values[i]
+
+
+def update_factored_belief(pomdp, belief, a, o):
+    """ Perform a belief update of a factored belief, in O(|H| ns) = O(|H|^2).
+
+        Parameters:
+            pomdp   --  The POMDP.
+            belief  --  The current ToCBelief.
+            a       --  The action index taken.
+            o       --  The observation index made.
+
+        Returns:
+            The next ToCBelief after taking an action and observing something.
+
+        Raises:
+            Exception if the belief is invalid due to an impossible observation.
+    """
+
+    S = as_numpy_array(pomdp.S, pomdp.n * pomdp.m * pomdp.ns).reshape(pomdp.n, pomdp.m, pomdp.ns)
+    T = as_numpy_array(pomdp.T, pomdp.n * pomdp.m * pomdp.ns).reshape(pomdp.n, pomdp.m, pomdp.ns)
+    O = as_numpy_array(pomdp.O, pomdp.m * pomdp.n * pomdp.z).reshape(pomdp.m, pomdp.n, pomdp.z)
+
+    successors = S[belief.states, a, :]
+    probabilities = T[belief.states, a, :] * belief.values[:, np.newaxis]
+
+    valid = (successors >= 0)
+    successors = successors[valid]
+    probabilities = probabilities[valid]
+
+    # Keep only the successors which could have produced the observation, merging duplicates.
+    possible = (O[a, successors, o] > 0.0)
+    statesPrime, inverse = np.unique(successors[possible], return_inverse=True)
+
+    valuesPrime = np.bincount(inverse, weights=probabilities[possible], minlength=len(statesPrime))
+    valuesPrime *= O[a, statesPrime, o]
+
+    if valuesPrime.sum() == 0.0:
+        raise Exception()
+
+    return ToCBelief(statesPrime, valuesPrime / valuesPrime.sum())
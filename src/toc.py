@@ -20,18 +20,110 @@
     CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 
+import numpy as np
 import random as rnd
 import itertools as it
+import json
+
+
+def npz_filename(filename):
+    """ Get the name of the binary file that save writes and load reads. Like np.savez, this appends the
+        .npz extension if it is missing, so that save("x") and load("x") refer to the same file.
+
+        Parameters:
+            filename    --  The name of the file, with or without the .npz extension.
+
+        Returns:
+            The name of the file with the .npz extension.
+    """
+
+    if not filename.endswith(".npz"):
+        filename += ".npz"
+
+    return filename
+
+
+class ToCTensor(object):
+    """ A dense array holding one of the ToC functions, which still behaves like the dict it replaces. """
+
+    def __init__(self, labels, array=None):
+        """ The constructor for the ToCTensor class.
+
+            Parameters:
+                labels  --  A list with one list per axis, containing the elements (e.g., toc.H) along that axis.
+                array   --  Optionally, the float array to wrap. Default is None, meaning all zeros.
+        """
+
+        self.labels = [list(axisLabels) for axisLabels in labels]
+        self.indexes = [{label: i for i, label in enumerate(axisLabels)} for axisLabels in self.labels]
+
+        if array is None:
+            array = np.zeros([len(axisLabels) for axisLabels in self.labels], dtype=float)
+        self.array = array
+
+    def index(self, key):
+        """ Convert a key of elements, e.g., (h, m, t, hp), into a tuple of array indexes.
+
+            Parameters:
+                key --  The key of elements, one for each axis.
+
+            Returns:
+                The corresponding tuple of integer indexes.
+
+            Raises:
+                KeyError if any element is not along its axis.
+        """
+
+        if len(key) != len(self.indexes):
+            raise KeyError(key)
+
+        return tuple(axisIndexes[label] for axisIndexes, label in zip(self.indexes, key))
+
+    def __getitem__(self, key):
+        return float(self.array[self.index(key)])
+
+    def __setitem__(self, key, value):
+        self.array[self.index(key)] = value
+
+    def __contains__(self, key):
+        try:
+            self.index(key)
+        except (KeyError, TypeError):
+            return False
+        return True
+
+    def __len__(self):
+        return self.array.size
+
+    def __iter__(self):
+        return self.keys()
+
+    def keys(self):
+        return it.product(*self.labels)
+
+    def values(self):
+        return (float(value) for value in self.array.flat)
+
+    def items(self):
+        return zip(self.keys(), self.values())
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
 
 
 class ToC(object):
     """ Transfer of Control (ToC) formal problem statement. """
 
-    def __init__(self, randomize=None):
+    def __init__(self, randomize=None, dense=False, rng=None):
         """ The constructor for the ToC class.
 
             Parameters:
                 randomize   --  Randomly assign values as (nh, nm, no, nt). Default is None.
+                dense       --  Store Ph, Pc, Po, and C as dense arrays (see densify). Default is False.
+                rng         --  Optionally, a numpy.random.Generator used to randomize. Default is None.
         """
 
         self.H = list()
@@ -43,10 +135,18 @@ class ToC(object):
         self.Po = dict()
         self.C = dict()
 
+        # The integer index of each element of H, M, O, and T. These are assigned by densify.
+        self.HIndex = dict()
+        self.MIndex = dict()
+        self.OIndex = dict()
+        self.TIndex = dict()
+
+        self.dense = dense
+
         if randomize is not None and len(randomize) == 4:
-            self.random(h=randomize[0], m=randomize[1], o=randomize[2], t=randomize[3])
+            self.random(h=randomize[0], m=randomize[1], o=randomize[2], t=randomize[3], rng=rng)
 
-    def random(self, v="v2", h=2, m=2, o=2, t=5):
+    def random(self, v="v2", h=2, m=2, o=2, t=5, rng=None):
         """ Define a ToC problem using a random version.
 
             Parameters:
@@ -55,13 +155,104 @@ class ToC(object):
                 m   --  The number of messages.
                 o   --  The number of observations.
                 t   --  The number of time steps (tau).
+                rng --  Optionally, a numpy.random.Generator. If given, the distributions are drawn in
+                        batches from it (see _random_batched), and the result is dense. Default is None.
         """
 
-        if v == "v1":
+        self.Ph = dict()
+        self.Pc = dict()
+        self.Po = dict()
+        self.C = dict()
+
+        if rng is not None:
+            self._random_batched(h, m, o, t, rng)
+        elif v == "v1":
             self._random_v1(h, m, o, t)
         elif v == "v2":
             self._random_v2(h, m, o, t)
 
+        if self.dense:
+            self.densify()
+
+    def densify(self):
+        """ Convert Ph, Pc, Po, and C into dense float arrays indexed by (h, m, t, h'), (h, m, t), (h, o),
+            and (h, m, t), respectively. Each remains accessible like a dict, e.g., toc.Ph[(h, m, t, hp)],
+            while the array itself is toc.Ph.array. Missing entries are zero.
+        """
+
+        self.HIndex = {h: i for i, h in enumerate(self.H)}
+        self.MIndex = {m: i for i, m in enumerate(self.M)}
+        self.OIndex = {o: i for i, o in enumerate(self.O)}
+        self.TIndex = {t: i for i, t in enumerate(self.T)}
+
+        Ph, Pc, Po, C = self.arrays()
+
+        self.Ph = ToCTensor([self.H, self.M, self.T, self.H], Ph)
+        self.Pc = ToCTensor([self.H, self.M, self.T], Pc)
+        self.Po = ToCTensor([self.H, self.O], Po)
+        self.C = ToCTensor([self.H, self.M, self.T], C)
+
+        self.dense = True
+
+    def arrays(self):
+        """ Get Ph, Pc, Po, and C as dense float arrays, following the axes described in densify. If this
+            ToC is dense, then these are the underlying arrays themselves (not copies).
+
+            Returns:
+                Ph  --  The |H|x|M|x|T|x|H| array of human state transitions.
+                Pc  --  The |H|x|M|x|T| array of the probability of transferring control.
+                Po  --  The |H|x|O| array of observation probabilities.
+                C   --  The |H|x|M|x|T| array of message costs.
+        """
+
+        labels = [[self.H, self.M, self.T, self.H], [self.H, self.M, self.T], [self.H, self.O], [self.H, self.M, self.T]]
+
+        result = list()
+        for values, valuesLabels in zip([self.Ph, self.Pc, self.Po, self.C], labels):
+            if isinstance(values, ToCTensor) and values.labels == [list(axisLabels) for axisLabels in valuesLabels]:
+                result += [values.array]
+            else:
+                tensor = ToCTensor(valuesLabels)
+                for key, value in values.items():
+                    tensor[key] = value
+                result += [tensor.array]
+
+        return tuple(result)
+
+    def save(self, filename):
+        """ Save the ToC problem to a binary (uncompressed numpy .npz) file.
+
+            Parameters:
+                filename    --  The name of the file to save. The .npz extension is added if missing.
+        """
+
+        Ph, Pc, Po, C = self.arrays()
+
+        np.savez(npz_filename(filename), Ph=Ph, Pc=Pc, Po=Po, C=C,
+                 sets=np.array(json.dumps({'H': self.H, 'M': self.M, 'O': self.O, 'T': self.T})))
+
+    def load(self, filename):
+        """ Load a ToC problem from a binary file created by save. The result is dense.
+
+            Parameters:
+                filename    --  The name of the file to load. The .npz extension is added if missing.
+        """
+
+        with np.load(npz_filename(filename)) as data:
+            sets = json.loads(str(data['sets']))
+
+            self.H = sets['H']
+            self.M = sets['M']
+            self.O = sets['O']
+            self.T = sets['T']
+
+            self.Ph = ToCTensor([self.H, self.M, self.T, self.H], data['Ph'])
+            self.Pc = ToCTensor([self.H, self.M, self.T], data['Pc'])
+            self.Po = ToCTensor([self.H, self.O], data['Po'])
+            self.C = ToCTensor([self.H, self.M, self.T], data['C'])
+
+        self.densify()
+
     def _random_v1(self, nh=2, nm=2, no=2, nt=5):
         """ Define a ToC problem using a random with an optional assignment of set sizes.
 
@@ -222,6 +413,71 @@ class ToC(object):
                     msgCost *= (self.Pc[(h, m, t)] > 0.0)
                     self.C[(h, m, t)] = msgCost
 
+    def _random_batched(self, nh=2, nm=2, no=2, nt=5, rng=None):
+        """ Define a ToC problem using random arrays drawn in batches from a numpy.random.Generator. The
+            distributions are the same as _random_v1 and _random_v2, but the result is reproducible per
+            generator and the cost is independent of Python loops over the sets. The result is dense.
+
+            Parameters:
+                nh  --  The number of of human states.
+                nm  --  The number of messages.
+                no  --  The number of observations.
+                nt  --  The number of time steps (tau).
+                rng --  The numpy.random.Generator. Default is None, meaning a freshly seeded one.
+        """
+
+        if rng is None:
+            rng = np.random.default_rng()
+
+        self.H = ["h%i" % (i) for i in range(nh)]
+        self.M = ["m%i" % (i) for i in range(nm)] + ["nop"]
+        self.O = ["o%i" % (i) for i in range(no)]
+        self.T = [int(i) for i in range(nt + 1)]
+
+        numH = len(self.H)
+        numM = len(self.M)
+        numO = len(self.O)
+        numT = len(self.T)
+
+        k = np.arange(numH).reshape(numH, 1, 1, 1)
+        i = np.arange(numM).reshape(1, numM, 1, 1)
+        j = np.arange(numH).reshape(1, 1, 1, numH)
+
+        # As in _random_v1, NOP and messages with index above the human state's index are uniform
+        # random noise, while the others have a high likelihood of the corresponding human state.
+        isFocused = (i <= k) & (i < numM - 1) & (i == j)
+        Ph = rng.random((numH, numM, numT, numH)) + float(numH) * isFocused
+        Ph /= Ph.sum(axis=3, keepdims=True)
+
+        # The probability of transferring control slowly decreases over time, with the same scaling
+        # by message and human state index as _random_v1.
+        t = np.arange(numT, dtype=float)
+        values = rng.uniform(0.5 * t / float(numT), 0.5 * (t + 1.0) / float(numT), size=(numH, numM, numT))
+        values = np.sort(values, axis=2)[:, :, ::-1]
+
+        i = np.arange(numM, dtype=float).reshape(1, numM, 1)
+        j = np.arange(numH, dtype=float).reshape(numH, 1, 1)
+        Pc = values * (float(numM) - 1.0 - i)**2 / float(numM)**2 * (float(numH) - j) / float(numH)
+        Pc *= (values > 0.3)
+
+        i = np.arange(numH).reshape(numH, 1)
+        j = np.arange(numO).reshape(1, numO)
+        Po = rng.random((numH, numO)) + float(numO) * (i == j)
+        Po /= Po.sum(axis=1, keepdims=True)
+
+        i = np.arange(numM, dtype=float).reshape(1, numM, 1)
+        t = np.arange(numT, dtype=float).reshape(1, 1, numT)
+        C = rng.uniform(0.25, 1.0, size=(numH, numM, numT)) * 10.0
+        C += np.abs((i + 1.0) / float(numM) - (float(numT) - t) / float(numT)) + 0.01
+        C *= (Pc > 0.0)
+
+        self.Ph = ToCTensor([self.H, self.M, self.T, self.H], Ph)
+        self.Pc = ToCTensor([self.H, self.M, self.T], Pc)
+        self.Po = ToCTensor([self.H, self.O], Po)
+        self.C = ToCTensor([self.H, self.M, self.T], C)
+
+        self.densify()
+
     def __str__(self):
         """ Convert this ToC object to a string representation.
 
@@ -263,5 +519,11 @@ if __name__ == "__main__":
     toc = ToC(randomize=(3, 2, 3, 5))
     print(toc)
 
+    toc.densify()
+    print(toc)
+
+    toc = ToC(randomize=(3, 2, 3, 5), rng=np.random.default_rng(0))
+    print(toc)
+
     print("Done.")
 
@@ -0,0 +1,192 @@
+""" The MIT License (MIT)
+
+    Copyright (c) 2015 Kyle Hollins Wray, University of Massachusetts
+
+    Permission is hereby granted, free of charge, to any person obtaining a copy of
+    this software and associated documentation files (the "Software"), to deal in
+    the Software without restriction, including without limitation the rights to
+    use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+    the Software, and to permit persons to whom the Software is furnished to do so,
+    subject to the following conditions:
+
+    The above copyright notice and this permission notice shall be included in all
+    copies or substantial portions of the Software.
+
+    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+    FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+    COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+    IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+    CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import numpy as np
+import collections
+import hashlib
+
+import os
+
+
+def digest(*values):
+    """ Compute a content hash of arrays and other values, e.g., to use as a ToCCache key.
+
+        Parameters:
+            values  --  Numpy arrays (hashed by dtype, shape, and bytes) and other values (hashed by repr).
+
+        Returns:
+            The hexadecimal SHA-1 digest.
+    """
+
+    result = hashlib.sha1()
+
+    for value in values:
+        if isinstance(value, np.ndarray):
+            value = np.ascontiguousarray(value)
+            result.update(("%s%s" % (value.dtype.str, str(value.shape))).encode())
+            result.update(value.tobytes())
+        else:
+            result.update(repr(value).encode())
+        result.update(b"|")
+
+    return result.hexdigest()
+
+
+class ToCCache(object):
+    """ A least-recently-used (LRU) cache of named numpy arrays, e.g., solved ToC POMDP policies, kept in
+        memory and optionally on disk. Keys are content hashes (see digest), so entries never go stale.
+    """
+
+    def __init__(self, directory=None, maxSize=64, maxFiles=1024):
+        """ The constructor for the ToCCache class.
+
+            Parameters:
+                directory   --  Optionally, a directory in which to also store entries as .npz files, so that
+                                they persist across runs. Default is None, meaning memory only.
+                maxSize     --  The maximum number of entries kept in memory. Default is 64.
+                maxFiles    --  The maximum number of entries kept on disk. Default is 1024.
+        """
+
+        self.directory = directory
+        self.maxSize = maxSize
+        self.maxFiles = maxFiles
+
+        self.entries = collections.OrderedDict()
+
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def _filename(self, key):
+        """ Get the filename of an entry on disk.
+
+            Parameters:
+                key --  The key of the entry.
+
+            Returns:
+                The filename.
+        """
+
+        return os.path.join(self.directory, "%s.npz" % (key))
+
+    def get(self, key):
+        """ Get an entry, marking it as most recently used.
+
+            Parameters:
+                key --  The key of the entry.
+
+            Returns:
+                The dict of named arrays, or None if it is not in the cache.
+        """
+
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+        if self.directory is None:
+            return None
+
+        filename = self._filename(key)
+
+        try:
+            with np.load(filename) as data:
+                arrays = {name: data[name] for name in data.files}
+        except (IOError, ValueError):
+            return None
+
+        # Touch the file so that the disk eviction also follows the least recently used order. Another run
+        # sharing the directory may have just evicted it, but the entry was still loaded.
+        try:
+            os.utime(filename)
+        except OSError:
+            pass
+
+        self._put_memory(key, arrays)
+
+        return arrays
+
+    def put(self, key, arrays):
+        """ Add an entry, evicting the least recently used entries as necessary.
+
+            Parameters:
+                key     --  The key of the entry.
+                arrays  --  The dict of named arrays.
+        """
+
+        self._put_memory(key, arrays)
+
+        if self.directory is None:
+            return
+
+        # Write to a temporary file first, so that concurrent runs never read a partial entry.
+        temporaryFilename = os.path.join(self.directory, "%s.%i.tmp.npz" % (key, os.getpid()))
+        np.savez(temporaryFilename, **arrays)
+        os.replace(temporaryFilename, self._filename(key))
+
+        filenames = [os.path.join(self.directory, f) for f in os.listdir(self.directory)
+                     if f.endswith(".npz") and not f.endswith(".tmp.npz")]
+
+        if len(filenames) > self.maxFiles:
+            filenames = sorted(filenames, key=lambda f: os.path.getmtime(f))
+            for f in filenames[:len(filenames) - self.maxFiles]:
+                try:
+                    os.remove(f)
+                except OSError:
+                    pass
+
+    def _put_memory(self, key, arrays):
+        """ Add an entry to the in-memory cache only, evicting the least recently used entries as necessary.
+
+            Parameters:
+                key     --  The key of the entry.
+                arrays  --  The dict of named arrays.
+        """
+
+        self.entries[key] = arrays
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.maxSize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        """ Remove all entries from memory and disk. """
+
+        self.entries.clear()
+
+        if self.directory is not None:
+            for f in os.listdir(self.directory):
+                if f.endswith(".npz"):
+                    os.remove(os.path.join(self.directory, f))
+
+
+if __name__ == "__main__":
+    print("Performing ToCCache Unit Test...")
+
+    cache = ToCCache(maxSize=2)
+
+    for i in range(3):
+        key = digest(np.arange(i + 1), i)
+        cache.put(key, {'values': np.arange(i + 1)})
+        print(key, cache.get(key))
+
+    print("Num Entries: %i" % (len(cache.entries)))
+
+    print("Done.")
@@ -20,6 +20,9 @@
     CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 
+import numpy as np
+import scipy.sparse as sparse
+import scipy.sparse.csgraph as csgraph
 import random as rnd
 import itertools as it
 
@@ -58,6 +61,78 @@ class ToCPath(object):
         # The LOSM object which is optionally loadable from an XML file.
         self.losm = None
 
+        # Indexes over the graph, created by load and random: the index of each vertex, the dense id of
+        # each edge, the forward and reverse adjacency lists, and the sets of autonomy-capable and
+        # autonomy-preferred edges for O(1) membership tests.
+        self.VIndex = dict()
+        self.EIndex = dict()
+        self.successors = dict()
+        self.predecessors = dict()
+        self.EcSet = set()
+        self.EpSet = set()
+
+        # The compressed sparse row (CSR) graph over the dense vertex indexes 0..|V|-1, also created by load
+        # and random. The edges out of vertex i are slots offsets[i] to offsets[i + 1] - 1, ordered by target
+        # (i.e., by direction in the ToC SSP), with their target index, weight, and autonomy flags. The UIDs in
+        # V are then only needed for input and output.
+        self.offsets = np.zeros(1, dtype=int)
+        self.targets = np.zeros(0, dtype=int)
+        self.weights = np.zeros(0, dtype=float)
+        self.capable = np.zeros(0, dtype=bool)
+        self.preferred = np.zeros(0, dtype=bool)
+        self.edgeKeys = np.zeros(0, dtype=int)
+        self.edgeSlots = np.zeros(0, dtype=int)
+
+    def _create_indexes(self):
+        """ Create the vertex and edge indexes, adjacency lists, and edge sets from V, E, Ec, and Ep. """
+
+        self.VIndex = {v: i for i, v in enumerate(self.V)}
+        self.EIndex = {e: i for i, e in enumerate(self.E)}
+
+        self.successors = {v: list() for v in self.V}
+        self.predecessors = {v: list() for v in self.V}
+        for v, vp in self.E:
+            self.successors[v] += [vp]
+            self.predecessors[vp] += [v]
+
+        self.EcSet = set(self.Ec)
+        self.EpSet = set(self.Ep)
+
+        edges = [(v, vp) for v in self.V for vp in sorted(self.successors[v])]
+        sources = np.array([self.VIndex[v] for v, vp in edges], dtype=int)
+
+        self.offsets = np.zeros(len(self.V) + 1, dtype=int)
+        self.offsets[1:] = np.cumsum([len(self.successors[v]) for v in self.V])
+        self.targets = np.array([self.VIndex[vp] for v, vp in edges], dtype=int)
+        self.weights = np.array([self.w[e] for e in edges], dtype=float)
+        self.capable = np.array([e in self.EcSet for e in edges], dtype=bool)
+        self.preferred = np.array([e in self.EpSet for e in edges], dtype=bool)
+
+        # The sorted (source, target) keys of the slots, for finding an edge's slot by binary search.
+        keys = sources * (len(self.V) + 1) + self.targets
+        self.edgeSlots = np.argsort(keys, kind='stable')
+        self.edgeKeys = keys[self.edgeSlots]
+
+    def edge_slot(self, v, vp):
+        """ Find the CSR slot of the edges between vertex indexes, e.g., to get their weights.
+
+            Parameters:
+                v   --  The source vertex index, or an array of them.
+                vp  --  The target vertex index, or an array of them. Indexes outside the graph are allowed.
+
+            Returns:
+                The slot of each edge, or -1 if there is no such edge.
+        """
+
+        keys = np.asarray(v) * (len(self.V) + 1) + np.asarray(vp)
+
+        if len(self.edgeKeys) == 0:
+            return np.full(np.shape(keys), -1)[()]
+
+        i = np.minimum(np.searchsorted(self.edgeKeys, keys), len(self.edgeKeys) - 1)
+
+        return np.where(self.edgeKeys[i] == keys, self.edgeSlots[i], -1)[()]
+
     def load(self, osmXMLFile):
         """ Load an OSM XML file and construct the ToC Path from that.
 
@@ -99,6 +174,8 @@ class ToCPath(object):
             self.v0 = rnd.choice(self.V)
             self.vg = rnd.choice(self.V)
 
+        self._create_indexes()
+
     def random(self, numVertexes=3, probAddEdge=0.25, probAutonomyCapable=0.5, probAutonomyPreferred=0.5):
         """ Create a random ToC Path object, given the number of desired vertexes.
 
@@ -125,8 +202,6 @@ class ToCPath(object):
                     e = (v, vp)
                     self.E += [e]
 
-        self.maxOutgoingDegree = max([len([e for e in self.E if e[0] == v]) for v in self.V])
-
         self.Ec = list()
         self.Ep = list()
         while len(self.Ec) == 0 and len(self.Ep) == 0:
@@ -143,6 +218,88 @@ class ToCPath(object):
         self.v0 = 0
         self.vg = numVertexes - 1
 
+        self._create_indexes()
+
+        self.maxOutgoingDegree = max([len(self.successors[v]) for v in self.V])
+
+    def shortest_distances(self, v, reverse=False):
+        """ Compute the shortest path distances (sums of weights) from a vertex with Dijkstra's algorithm,
+            or, in reverse, to the vertex.
+
+            Parameters:
+                v       --  The vertex UID.
+                reverse --  Optionally compute the distances to v instead of from v. Default is False.
+
+            Returns:
+                The |V|-array of distances by vertex index, with infinity for the vertexes not connected to v.
+        """
+
+        # Keep only the lightest of any parallel edges, since sparse matrices would sum them.
+        keys, first = np.unique(self.edgeKeys, return_index=True)
+        weights = np.minimum.reduceat(self.weights[self.edgeSlots], first) if len(keys) > 0 else np.zeros(0)
+
+        graph = sparse.csr_matrix((weights, (keys // (len(self.V) + 1), keys % (len(self.V) + 1))),
+                                  shape=(len(self.V), len(self.V)))
+
+        # Zero weights would be dropped as missing edges by csgraph, so make them tiny instead.
+        graph.data[graph.data <= 0.0] = np.finfo(float).tiny
+
+        return csgraph.dijkstra(graph.T if reverse else graph, directed=True, indices=self.VIndex[v])
+
+    def corridor(self, detourFactor=1.5):
+        """ Create the ToC Path restricted to the corridor between the initial and goal vertexes, i.e., the
+            vertexes for which the shortest path from v0 to vg through them costs at most detourFactor times
+            the shortest path from v0 to vg, found with forward and reverse Dijkstra.
+
+            Parameters:
+                detourFactor    --  Optionally, the maximum ratio of the detour cost to the optimal cost.
+                                    Default is 1.5.
+
+            Returns:
+                The new ToC Path over the corridor's vertexes and the edges between them.
+
+            Raises:
+                ValueError if detourFactor is less than 1, or if vg is unreachable from v0.
+        """
+
+        if detourFactor < 1.0:
+            raise ValueError("The detour factor %s is less than 1, which would exclude every path." % \
+                             (str(detourFactor)))
+
+        fromStart = self.shortest_distances(self.v0)
+        toGoal = self.shortest_distances(self.vg, reverse=True)
+
+        optimal = fromStart[self.VIndex[self.vg]]
+        if np.isinf(optimal):
+            raise ValueError("The goal vertex '%s' is unreachable from the initial vertex '%s'." % \
+                             (str(self.vg), str(self.v0)))
+
+        # A small tolerance keeps the vertexes on the optimal paths despite rounding.
+        keep = (fromStart + toGoal <= detourFactor * optimal * (1.0 + 1e-9))
+
+        assert keep[self.VIndex[self.v0]] and keep[self.VIndex[self.vg]]
+
+        path = ToCPath()
+
+        path.V = [v for v, k in zip(self.V, keep) if k]
+        path.loc = [l for l, k in zip(self.loc, keep) if k] if len(self.loc) == len(self.V) else list()
+
+        kept = set(path.V)
+        path.E = [e for e in self.E if e[0] in kept and e[1] in kept]
+        path.Ec = [e for e in self.Ec if e[0] in kept and e[1] in kept]
+        path.Ep = [e for e in self.Ep if e[0] in kept and e[1] in kept]
+        path.w = {e: self.w[e] for e in path.E}
+
+        path.v0 = self.v0
+        path.vg = self.vg
+        path.losm = self.losm
+
+        path._create_indexes()
+
+        path.maxOutgoingDegree = max([len(path.successors[v]) for v in path.V] + [0])
+
+        return path
+
     def __str__(self):
         """ Print a pretty string of the ToCPath object.
 
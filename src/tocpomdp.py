@@ -20,19 +20,119 @@
     CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 
+import numpy as np
+import scipy.sparse as sparse
+import scipy.sparse.linalg
 import itertools as it
-import ctypes as ct
+import json
+import time
 
 import os
 import sys
 
 thisFilePath = os.path.dirname(os.path.realpath(__file__))
 
+# Without nova (or its compiled library), the models still build and solve with the numpy backends.
 sys.path.append(os.path.join(thisFilePath, "..", "..", "nova", "python"))
-from nova.mdp import *
-from nova.pomdp import *
+try:
+    from nova.mdp import *
+    from nova.pomdp import *
+    novaAvailable = True
+except (ImportError, OSError):
+    novaAvailable = False
 
 from toc import *
+from toccache import *
+
+
+class _NovaUnavailable(object):
+    """ A plain stand-in for nova's MDP and POMDP base classes, used when nova cannot be imported. """
+
+    def solve(self, *args, **kwargs):
+        """ Fail to solve with nova, since it is unavailable.
+
+            Raises:
+                Exception always, as only the numpy backend (or backward induction) can solve.
+        """
+
+        raise Exception("Failed to solve with nova, since it is unavailable. Use backend='numpy' instead.")
+
+
+if not novaAvailable:
+    MDP = _NovaUnavailable
+    POMDP = _NovaUnavailable
+
+
+def as_nova_array(values, dtype):
+    """ Flatten values into a contiguous numpy buffer and wrap it as a ctypes array for nova. If values
+        is already a contiguous array of this dtype, then the buffer is shared instead of copied.
+
+        Parameters:
+            values  --  The array-like values.
+            dtype   --  The numpy dtype matching nova's ctypes type, e.g., np.intc for ct.c_int.
+
+        Returns:
+            The ctypes array, which keeps the numpy buffer alive.
+    """
+
+    return np.ctypeslib.as_ctypes(np.ascontiguousarray(values, dtype=dtype).ravel())
+
+
+def as_numpy_array(novaArray, size):
+    """ View a ctypes array (or pointer) assigned to a nova object as a flat numpy array, without a copy.
+
+        Parameters:
+            novaArray   --  The ctypes array or pointer, e.g., pomdp.S.
+            size        --  The number of elements, e.g., pomdp.n * pomdp.m * pomdp.ns.
+
+        Returns:
+            The numpy array sharing the memory of novaArray.
+    """
+
+    return np.ctypeslib.as_array(novaArray, shape=(size,))
+
+
+def cumulative_table(probabilities):
+    """ Precompute the cumulative distribution of each row of probabilities, for sampling with sample_cumulative.
+        Each row is normalized and every entry from its last non-zero probability onward is exactly 1.0, so
+        floating point drift can never leave a draw in [0, 1) without an outcome.
+
+        Parameters:
+            probabilities   --  The array of probabilities, with the outcomes along the last axis.
+
+        Returns:
+            The float array of cumulative probabilities, with the same shape. Rows of all zeros stay all zeros.
+    """
+
+    probabilities = np.asarray(probabilities, dtype=float)
+    k = probabilities.shape[-1]
+
+    total = probabilities.sum(axis=-1, keepdims=True)
+    cdf = np.cumsum(probabilities, axis=-1) / np.where(total > 0.0, total, 1.0)
+
+    lastPositive = k - 1 - np.argmax(probabilities[..., ::-1] > 0.0, axis=-1)
+    cdf[(np.arange(k) >= lastPositive[..., np.newaxis]) & (total > 0.0)] = 1.0
+
+    return cdf
+
+
+def sample_cumulative(cdf, u):
+    """ Sample outcomes from cumulative distributions, i.e., the first index with cumulative probability above u.
+
+        Parameters:
+            cdf --  The cumulative probabilities from cumulative_table, either one row or a k-by-x array of rows.
+            u   --  The uniform random number(s) in [0, 1), either one or a k-array, one per row.
+
+        Returns:
+            The outcome index, or k-array of outcome indexes.
+    """
+
+    cdf = np.asarray(cdf)
+
+    if cdf.ndim == 1:
+        return min(int(np.searchsorted(cdf, u, side='right')), len(cdf) - 1)
+
+    return np.minimum((cdf <= np.asarray(u)[:, np.newaxis]).sum(axis=-1), cdf.shape[-1] - 1)
 
 
 class ToCPOMDP(POMDP):
@@ -47,6 +147,92 @@ class ToCPOMDP(POMDP):
         self.actions = list()
         self.observations = list()
 
+        # The index of each state, action, and observation, for O(1) lookups instead of list.index.
+        self.statesIndex = dict()
+        self.actionsIndex = dict()
+        self.observationsIndex = dict()
+
+        # The sparse per-action transition matrices, the observation table, and the cumulative tables for
+        # sampling, created on demand.
+        self.transitionMatrices = None
+        self.observationTable = None
+        self.transitionCumulative = None
+        self.observationCumulative = None
+
+    def _create_indexes(self):
+        """ Create the dicts mapping each state, action, and observation to its index. """
+
+        self.statesIndex = {state: s for s, state in enumerate(self.states)}
+        self.actionsIndex = {action: a for a, action in enumerate(self.actions)}
+        self.observationsIndex = {observation: o for o, observation in enumerate(self.observations)}
+
+        self.transitionMatrices = None
+        self.observationTable = None
+        self.transitionCumulative = None
+        self.observationCumulative = None
+
+    def transition_matrices(self):
+        """ Get the sparse transition matrix of each action, created from S and T on the first call.
+
+            Returns:
+                A list with, for each action a, the n-by-n scipy.sparse CSR matrix of T(s, a, s').
+        """
+
+        if self.transitionMatrices is None:
+            S = as_numpy_array(self.S, self.n * self.m * self.ns).reshape(self.n, self.m, self.ns)
+            T = as_numpy_array(self.T, self.n * self.m * self.ns).reshape(self.n, self.m, self.ns)
+
+            rows = np.repeat(np.arange(self.n), self.ns)
+
+            self.transitionMatrices = list()
+            for a in range(self.m):
+                valid = (S[:, a, :].ravel() >= 0)
+                self.transitionMatrices += [sparse.csr_matrix((T[:, a, :].ravel()[valid].astype(float),
+                                                               (rows[valid], S[:, a, :].ravel()[valid])),
+                                                              shape=(self.n, self.n))]
+
+        return self.transitionMatrices
+
+    def observation_table(self):
+        """ Get the observation probabilities ordered by (action, observation, successor), created from O on
+            the first call, so that the vector over successors for an action and observation is contiguous.
+
+            Returns:
+                The m-by-z-by-n array of O(a, s', o).
+        """
+
+        if self.observationTable is None:
+            O = as_numpy_array(self.O, self.m * self.n * self.z).reshape(self.m, self.n, self.z)
+            self.observationTable = np.ascontiguousarray(O.transpose(0, 2, 1), dtype=float)
+
+        return self.observationTable
+
+    def transition_cumulative(self):
+        """ Get the cumulative transition probabilities over successors, created from T on the first call.
+
+            Returns:
+                The n-by-m-by-ns array of cumulative T(s, a, S(s, a, i)), for use with sample_cumulative.
+        """
+
+        if self.transitionCumulative is None:
+            T = as_numpy_array(self.T, self.n * self.m * self.ns).reshape(self.n, self.m, self.ns)
+            self.transitionCumulative = cumulative_table(T)
+
+        return self.transitionCumulative
+
+    def observation_cumulative(self):
+        """ Get the cumulative observation probabilities over observations, created from O on the first call.
+
+            Returns:
+                The m-by-n-by-z array of cumulative O(a, s', o), for use with sample_cumulative.
+        """
+
+        if self.observationCumulative is None:
+            O = as_numpy_array(self.O, self.m * self.n * self.z).reshape(self.m, self.n, self.z)
+            self.observationCumulative = cumulative_table(O)
+
+        return self.observationCumulative
+
     def create(self, toc):
         """ Create the POMDP given the ToC problem.
 
@@ -67,145 +253,130 @@ class ToCPOMDP(POMDP):
 
         self.ns = len(toc.H) + 1 # Add the possible "success" state as a successor, too.
 
-        S = [[[int(-1) for sp in range(self.ns)] for a in range(self.m)] for s in range(self.n)]
-        T = [[[float(0.0) for sp in range(self.ns)] for a in range(self.m)] for s in range(self.n)]
-        for s, state in enumerate(self.states):
-            for a, action in enumerate(self.actions):
-                cur = 0
-
-                for sp, statePrime in enumerate(self.states):
-                    # Absorbing states always self-loop.
-                    if state in calE and statePrime in calE and state == statePrime:
-                        S[s][a][cur] = sp
-                        T[s][a][cur] = 1.0
-                        cur += 1
-
-                    # If the agent aborts, then transition to aborted. This is always an option.
-                    if state not in calE and action == "abort" and statePrime == "aborted":
-                        S[s][a][cur] = sp
-                        T[s][a][cur] = 1.0
-                        cur += 1
-
-                    # Randomly, it may actually succeed to transfer control.
-                    if state not in calE and action != "abort" and statePrime == "success":
-                        S[s][a][cur] = sp
-                        T[s][a][cur] = toc.Pc[(state[1], state[2], state[3])]
-                        cur += 1
-
-                    # If the countdown runs out of time, then it is over if control fails to transfer.
-                    # At this point, it is too late to "abort".
-                    if state not in calE and state[0] == 0 and action != "abort" and statePrime == "failure":
-                        S[s][a][cur] = sp
-                        T[s][a][cur] = 1.0 - toc.Pc[(state[1], state[2], state[3])]
-                        cur += 1
-
-                    # If the agent does not abort, then there are two cases. First, (1) no message is sent (i.e., "nop").
-                    # In this case, the distribution follows toc.Ph, but only if the next state:
-                    # (a) decrements the timer, (b) distribution over human states, (c) same message, (d) increased time
-                    # since the last message, or self-loop for the maximal case.
-                    if state not in calE and state[0] > 0 and action != "abort" and statePrime not in calE and \
-                            action == "nop" and statePrime[0] == state[0] - 1 and statePrime[2] == state[2]:
-                        if statePrime[3] == state[3] + 1:
-                            S[s][a][cur] = sp
-                            T[s][a][cur] = (1.0 - toc.Pc[(state[1], state[2], state[3])]) * toc.Ph[(state[1], state[2], state[3], statePrime[1])]
-                            cur += 1
-                        elif statePrime[3] == state[3] and statePrime[3] == len(toc.T) - 1 and statePrime[1] == state[1]:
-                            S[s][a][cur] = sp
-                            T[s][a][cur] = 1.0 - toc.Pc[(state[1], state[2], state[3])]
-                            cur += 1
-
-                    # Next, the other case: (2) a message is sent.
-                    if state not in calE and state[0] > 0 and action != "abort" and statePrime not in calE and \
-                            action != "nop" and statePrime[0] == state[0] - 1 and statePrime[2] == action and statePrime[3] == 0:
-                        S[s][a][cur] = sp
-                        T[s][a][cur] = (1.0 - toc.Pc[(state[1], state[2], state[3])]) * toc.Ph[(state[1], state[2], state[3], statePrime[1])]
-                        cur += 1
-
-        array_type_nmns_int = ct.c_int * (self.n * self.m * self.ns)
-        array_type_nmns_float = ct.c_float * (self.n * self.m * self.ns)
-
-        self.S = array_type_nmns_int(*np.array(S).flatten())
-        self.T = array_type_nmns_float(*np.array(T).flatten())
-
-        O = [[[0.0 for z in range(self.z)] for sp in range(self.n)] for a in range(self.m)]
-        for a, action in enumerate(self.actions):
-            for sp, statePrime in enumerate(self.states):
-                for o, observation in enumerate(self.observations):
-                    # In terminal states, there's a 1.0 probability of the agent knowing it is there.
-                    if statePrime in calE and observation == statePrime:
-                        O[a][sp][o] = 1.0
-
-                    # Otherwise, the probability follows from the ToC object, given the observation is valid.
-                    if statePrime not in calE and observation not in calE:
-                        O[a][sp][o] = toc.Po[(statePrime[1], observation)]
-
-        array_type_mnz_float = ct.c_float * (self.m * self.n * self.z)
-        self.O = array_type_mnz_float(*np.array(O).flatten())
+        self._create_indexes()
+
+        # Non-terminal states are (time remaining, human state, last message, time since last message),
+        # enumerated in that order, so each factor is an axis of the array below. The absorbing states
+        # 'success', 'failure', and 'aborted' follow them.
+        numT = len(toc.T)
+        numH = len(toc.H)
+        numM = len(toc.M)
+
+        nonTerminal = np.arange(numT * numH * numM * numT).reshape(numT, numH, numM, numT)
+        success, failure, aborted = [nonTerminal.size + calE.index(e) for e in calE]
+
+        nop = toc.M.index("nop")
+        abort = self.actionsIndex["abort"]
+
+        Ph, Pc, Po, C = toc.arrays()
+
+        S = np.full((self.n, self.m, self.ns), -1, dtype=np.intc)
+        T = np.zeros((self.n, self.m, self.ns), dtype=np.float32)
+
+        # Views of S and T over the non-terminal states, indexed by (t, h, m, tm, action, successor).
+        Sf = S[:nonTerminal.size].reshape(numT, numH, numM, numT, self.m, self.ns)
+        Tf = T[:nonTerminal.size].reshape(numT, numH, numM, numT, self.m, self.ns)
+
+        # Absorbing states always self-loop.
+        for e in [success, failure, aborted]:
+            S[e, :, 0] = e
+            T[e, :, 0] = 1.0
+
+        # If the agent aborts, then transition to aborted. This is always an option.
+        Sf[:, :, :, :, abort, 0] = aborted
+        Tf[:, :, :, :, abort, 0] = 1.0
+
+        # The probability of failing to transfer control times the human state transition, indexed
+        # by (h, m, tm, h'); both follow the current state, not the action.
+        PhNoControl = (1.0 - Pc)[:, :, :, np.newaxis] * Ph
+
+        for a in range(len(toc.M)):
+            # If the countdown runs out of time, then it is over if control fails to transfer. Randomly,
+            # it may actually succeed to transfer control. At this point, it is too late to "abort".
+            Sf[0, :, :, :, a, 0] = success
+            Tf[0, :, :, :, a, 0] = Pc
+            Sf[0, :, :, :, a, 1] = failure
+            Tf[0, :, :, :, a, 1] = 1.0 - Pc
+
+            # Otherwise, the timer decrements. First, (1) no message is sent (i.e., "nop"). The human state
+            # follows toc.Ph, with the same message and increased time since the last message, or it
+            # self-loops (same human state) for the maximal time since the last message.
+            if a == nop:
+                Sf[1:, :, :, :-1, a, :numH] = nonTerminal[:-1, :, :, 1:].transpose(0, 2, 3, 1)[:, np.newaxis]
+                Tf[1:, :, :, :-1, a, :numH] = PhNoControl[np.newaxis, :, :, :-1, :]
+                Sf[1:, :, :, :-1, a, numH] = success
+                Tf[1:, :, :, :-1, a, numH] = Pc[np.newaxis, :, :, :-1]
+
+                Sf[1:, :, :, -1, a, 0] = nonTerminal[:-1, :, :, -1]
+                Tf[1:, :, :, -1, a, 0] = 1.0 - Pc[np.newaxis, :, :, -1]
+                Sf[1:, :, :, -1, a, 1] = success
+                Tf[1:, :, :, -1, a, 1] = Pc[np.newaxis, :, :, -1]
+
+            # Next, the other case: (2) a message is sent, so it becomes the last message and the time
+            # since the last message resets.
+            else:
+                Sf[1:, :, :, :, a, :numH] = nonTerminal[:-1, :, a, 0][:, np.newaxis, np.newaxis, np.newaxis, :]
+                Tf[1:, :, :, :, a, :numH] = PhNoControl[np.newaxis]
+                Sf[1:, :, :, :, a, numH] = success
+                Tf[1:, :, :, :, a, numH] = Pc[np.newaxis]
+
+        self.S = as_nova_array(S, np.intc)
+        self.T = as_nova_array(T, np.float32)
+
+        # In terminal states, there's a 1.0 probability of the agent knowing it is there. Otherwise, the
+        # probability follows from the ToC object, given the observation is valid.
+        O = np.zeros((self.m, self.n, self.z), dtype=np.float32)
+        humanStates = np.broadcast_to(np.arange(numH)[np.newaxis, :, np.newaxis, np.newaxis], nonTerminal.shape)
+        O[:, :nonTerminal.size, :len(toc.O)] = Po[humanStates.ravel()][np.newaxis]
+        for e in calE:
+            O[:, self.statesIndex[e], self.observationsIndex[e]] = 1.0
+
+        self.O = as_nova_array(O, np.float32)
 
         # Compute the maximum and non-zero minimum ToC's cost.
-        Cmax = max([value for key, value in toc.C.items()])
-        Cmin = min([value for key, value in toc.C.items() if value > 0.0])
-
-        R = [[0.0 for a in range(self.m)] for s in range(self.n)]
-        for s, state in enumerate(self.states):
-            for a, action in enumerate(self.actions):
-                # There is no cost in the goal 'success' state.
-                if state == "success":
-                    R[s][a] = 0.0
-
-                # Failure repeatedly has the worst cost.
-                if state == "failure":
-                    R[s][a] = -Cmax #-1e+35
-
-                # The aborted state is not ideal, but is better than failure.
-                if state == "aborted":
-                    R[s][a] = 0.0 #-Cmin
-
-                # Abort pays the maximal cost over all time steps; much better
-                # than failure though.
-                if state not in calE and action == "abort":
-                    if state[0] > 0:
-                        R[s][a] = -self.n * Cmax #-Cmax# * len(toc.T)
-                    else:
-                        R[s][a] = 0.0
+        Cmax = C.max()
+        Cmin = C[C > 0.0].min()
+
+        R = np.zeros((self.n, self.m), dtype=np.float32)
+        Rf = R[:nonTerminal.size].reshape(numT, numH, numM, numT, self.m)
+
+        # There is no cost in the goal 'success' state, and the aborted state is not ideal, but is
+        # better than failure. Failure repeatedly has the worst cost.
+        R[failure, :] = -Cmax #-1e+35
 
-                # NOP has a very small immediate cost, as well as "abort".
-                if state not in calE and action == "nop":
-                    # Note: This value has to be less than the reward for aborting at state[0] == 0 above.
-                    # If not, then it will fail to choose abort.
-                    R[s][a] = -0.01
+        # All non-terminal states have a cost equal to the toc.C values for messages. This is based on
+        # the human's state, how long it has been since the human was annoyed, and the *new* message
+        # just chosen.
+        Rf[:, :, :, :, :len(toc.M)] = -C[np.newaxis, :, :, :, np.newaxis]
 
-                # All other states have a cost equal to the toc.C values. This is based on
-                # the human's state, how long it has been since the human was annoyed,
-                # and the *new* message just chosen.
-                if state not in calE and action not in ["nop", "abort"]:
-                    R[s][a] = -toc.C[(state[1], state[2], state[3])]
+        # NOP has a very small immediate cost. Note: This value has to be less than the reward for
+        # aborting at state[0] == 0 below. If not, then it will fail to choose abort.
+        Rf[:, :, :, :, nop] = -0.01
 
-        self.Rmax = np.array(R).max()
-        self.Rmin = np.array(R).min()
+        # Abort pays the maximal cost over all time steps; much better than failure though.
+        Rf[1:, :, :, :, abort] = -self.n * Cmax #-Cmax# * len(toc.T)
+        Rf[0, :, :, :, abort] = 0.0
 
-        array_type_nm_float = ct.c_float * (self.n * self.m)
+        self.Rmax = R.max()
+        self.Rmin = R.min()
 
-        self.R = array_type_nm_float(*np.array(R).flatten())
+        self.R = as_nova_array(R, np.float32)
 
         # Setup the belief points. We begin with a seed state uniform over all three
         # human states, and maximal time remaining, maximal time since last message,
         # and the last message was NOP.
-        Z = [[self.states.index((len(toc.T) - 1, h, "nop", len(toc.T) - 1)) for h in toc.H]]
+        Z = [[self.statesIndex[(len(toc.T) - 1, h, "nop", len(toc.T) - 1)] for h in toc.H]]
         B = [[1.0 / float(len(toc.H)) for h in toc.H]]
 
         # Add beliefs for the final time step in order to guarantee abort can always be executed.
-        Z += [[self.states.index((0, h, m, t)) for h in toc.H] for m, t in it.product(toc.M, toc.T)]
+        Z += [[self.statesIndex[(0, h, m, t)] for h in toc.H] for m, t in it.product(toc.M, toc.T)]
         B += [[1.0 / float(len(toc.H)) for h in toc.H] for m, t in it.product(toc.M, toc.T)]
 
         self.r = len(B)
         self.rz = len(toc.H)
 
-        array_type_rrz_int = ct.c_int * (self.r * self.rz)
-        array_type_rrz_float = ct.c_float * (self.r * self.rz)
-
-        self.Z = array_type_rrz_int(*np.array(Z).flatten())
-        self.B = array_type_rrz_float(*np.array(B).flatten())
+        self.Z = as_nova_array(Z, np.intc)
+        self.B = as_nova_array(B, np.float32)
 
         # There was only one reward, and there's a simple discount factor.
         self.k = 1
@@ -215,12 +386,524 @@ class ToCPOMDP(POMDP):
         # make sure it also realizes how bad some of the absorbing states are.
         self.horizon = len(toc.T) * 10
 
-        #self.expand(method='random', numBeliefsToAdd=100)
-        for i in range(5):
-            self.expand(method='distinct_beliefs')
+        # Without nova, expand the belief points in the same way with numpy instead.
+        if novaAvailable:
+            #self.expand(method='random', numBeliefsToAdd=100)
+            for i in range(5):
+                self.expand(method='distinct_beliefs')
+        else:
+            self.set_belief_points(self.expand_numpy(self.belief_points(), 5))
         #for i in range(len(toc.T) * 5):
         #    self.expand(method='pema')
 
+    def solve(self, *args, **kwargs):
+        """ Solve the POMDP. If algorithm is 'backward', then this calls solve_backward with any remaining
+            keyword arguments. If backend is 'numpy', then this calls solve_numpy with the algorithm and any
+            remaining keyword arguments. Both ignore nova's process settings. Otherwise, this is nova's solve,
+            with the same arguments. The backend is 'nova' by default, or 'numpy' if nova is unavailable.
+
+            Returns:
+                Gamma   --  The alpha-vectors.
+                pi      --  The corresponding actions for each alpha-vector.
+                timing  --  The timing information.
+        """
+
+        algorithm = kwargs.get('algorithm', args[0] if len(args) > 0 else None)
+        backend = kwargs.pop('backend', "nova" if novaAvailable else "numpy")
+
+        # Neither backward induction nor the numpy backend uses nova's process settings.
+        if algorithm == 'backward' or backend == "numpy":
+            kwargs.pop('algorithm', None)
+            for setting in ['process', 'numThreads']:
+                kwargs.pop(setting, None)
+
+        if algorithm == 'backward':
+            return self.solve_backward(**kwargs)
+
+        if backend == "numpy":
+            return self.solve_numpy(algorithm=algorithm if algorithm is not None else 'pbvi', **kwargs)
+
+        return super().solve(*args, **kwargs)
+
+    def belief_points(self):
+        """ Get the belief points (Z and B) as dense beliefs.
+
+            Returns:
+                The r-by-n array of belief points, one per row.
+        """
+
+        Z = as_numpy_array(self.Z, self.r * self.rz).reshape(self.r, self.rz)
+        B = as_numpy_array(self.B, self.r * self.rz).reshape(self.r, self.rz)
+
+        beliefs = np.zeros((self.r, self.n))
+        for i in range(self.r):
+            valid = (Z[i] >= 0)
+            np.add.at(beliefs[i], Z[i][valid], B[i][valid])
+        beliefs /= beliefs.sum(axis=1, keepdims=True)
+
+        return beliefs
+
+    def set_belief_points(self, beliefs):
+        """ Set the belief points (Z and B) from dense beliefs, e.g., those from expand_numpy.
+
+            Parameters:
+                beliefs --  The k-by-n array of belief points, one per row.
+        """
+
+        support = [np.flatnonzero(b) for b in beliefs]
+
+        self.r = len(beliefs)
+        self.rz = max(len(states) for states in support)
+
+        Z = np.full((self.r, self.rz), -1, dtype=np.intc)
+        B = np.zeros((self.r, self.rz), dtype=np.float32)
+        for i, states in enumerate(support):
+            Z[i, :len(states)] = states
+            B[i, :len(states)] = beliefs[i, states]
+
+        self.Z = as_nova_array(Z, np.intc)
+        self.B = as_nova_array(B, np.float32)
+
+    def expand_numpy(self, beliefs, numExpansions=1, rng=None):
+        """ Expand a set of belief points with numpy, following the distinct beliefs method: from each belief,
+            for each action, sample an observation and compute the successor belief, then add the successor
+            which is farthest (in L1 distance) from all current beliefs, if it is new.
+
+            Parameters:
+                beliefs         --  The k-by-n array of belief points, one per row.
+                numExpansions   --  Optionally, the number of times to expand. Default is 1.
+                rng             --  Optionally, the numpy.random.Generator to use. Default is None.
+
+            Returns:
+                The array of belief points, with the new beliefs appended.
+        """
+
+        if rng is None:
+            rng = np.random.default_rng()
+
+        O = self.observation_table()
+
+        for i in range(numExpansions):
+            candidates = list()
+
+            for a in range(self.m):
+                # The joint probability of successors and each observation, then a sampled observation per belief.
+                joint = self.transition_matrices()[a].T.dot(beliefs.T).T[:, np.newaxis, :] * O[a][np.newaxis, :, :]
+                o = sample_cumulative(cumulative_table(joint.sum(axis=2)), rng.random(len(beliefs)))
+
+                successors = joint[np.arange(len(beliefs)), o, :]
+                normalizer = successors.sum(axis=1, keepdims=True)
+                candidates += [np.where(normalizer > 0.0, successors / np.where(normalizer > 0.0, normalizer, 1.0),
+                                        np.nan)]
+
+            # For each belief, keep the candidate farthest from the current set. The L1 distances are computed
+            # in chunks of candidates, since all of them at once take O(k^2 n) memory.
+            candidates = np.stack(candidates, axis=1)
+            chunkSize = max(1, 2**22 // (len(beliefs) * self.n))
+
+            distances = np.zeros((len(beliefs), self.m))
+            for a in range(self.m):
+                for j in range(0, len(beliefs), chunkSize):
+                    distances[j:j + chunkSize, a] = np.abs(candidates[j:j + chunkSize, a, np.newaxis, :] -
+                                                           beliefs[np.newaxis, :, :]).sum(axis=2).min(axis=1)
+            distances = np.where(np.isnan(distances), -1.0, distances)
+
+            best = distances.argmax(axis=1)
+            added = candidates[np.arange(len(beliefs)), best][distances[np.arange(len(beliefs)), best] > 0.0]
+
+            if len(added) == 0:
+                break
+
+            beliefs = np.vstack([beliefs, np.unique(np.round(added, 12), axis=0)])
+
+        return beliefs
+
+    def solve_numpy(self, algorithm='pbvi', numExpansions=0, epsilon=0.001, rng=None):
+        """ Solve the POMDP with point-based value iteration in numpy, instead of with nova. The belief points
+            are Z and B (optionally expanded with expand_numpy), and the alpha-vectors start at the lower bound
+            of the blind policies. Each iteration first projects all alpha-vectors through every action and
+            observation as one sparse product per action, then:
+                'pbvi'      --  Backs up every belief point at once, as batched tensor contractions.
+                'perseus'   --  Backs up randomly chosen belief points only until every belief point's value
+                                has improved (Spaan and Vlassis, 2005), keeping the old best alpha-vector
+                                for a belief point whose backup did not improve it.
+            Iterations stop once the largest change in the value of any belief point is below epsilon, or after
+            horizon iterations.
+
+            Parameters:
+                algorithm       --  Either 'pbvi' or 'perseus'. Default is 'pbvi'.
+                numExpansions   --  Optionally, the number of expand_numpy expansions of the belief points.
+                                    Default is 0.
+                epsilon         --  Optionally, the convergence threshold on the belief points' values.
+                                    Default is 0.001.
+                rng             --  Optionally, the numpy.random.Generator to use. Default is None.
+
+            Returns:
+                Gamma   --  The alpha-vectors, an array with one row per alpha-vector.
+                pi      --  The corresponding actions for each alpha-vector.
+                timing  --  The (wall, CPU) time in seconds.
+        """
+
+        timing = (time.time(), time.process_time())
+
+        if rng is None:
+            rng = np.random.default_rng()
+
+        R = as_numpy_array(self.R, self.n * self.m).reshape(self.n, self.m).astype(float)
+        O = self.observation_table()
+        gamma = float(self.gamma)
+
+        beliefs = self.expand_numpy(self.belief_points(), numExpansions, rng)
+
+        def backup(G, beliefs):
+            # For each action, the best projected alpha-vector for each observation at each belief.
+            values = np.full(len(beliefs), -np.inf)
+            alphas = np.zeros((len(beliefs), self.n))
+            actions = np.zeros(len(beliefs), dtype=int)
+
+            for a in range(self.m):
+                j = np.einsum('zkn,bn->bzk', G[a], beliefs).argmax(axis=2)
+                alphasA = R[:, a] + G[a][np.arange(self.z)[np.newaxis, :], j, :].sum(axis=1)
+                valuesA = (alphasA * beliefs).sum(axis=1)
+
+                improved = (valuesA > values)
+                values[improved] = valuesA[improved]
+                alphas[improved] = alphasA[improved]
+                actions[improved] = a
+
+            return alphas, actions, values
+
+        # Start from the blind policies, which always take the same action, as a lower bound much tighter than
+        # Rmin / (1 - gamma): each alpha-vector solves (I - gamma T_a) alpha = R_a.
+        identity = sparse.identity(self.n, format='csr')
+        Gamma = np.array([sparse.linalg.spsolve((identity - gamma * self.transition_matrices()[a]).tocsc(), R[:, a])
+                          for a in range(self.m)])
+        pi = np.arange(self.m)
+
+        values = beliefs.dot(Gamma.T).max(axis=1)
+
+        for iteration in range(self.horizon):
+            # G[a][o, k, s] = gamma * sum_{s'} T(s, a, s') O(a, s', o) Gamma[k, s'].
+            G = list()
+            for a in range(self.m):
+                projected = (O[a][:, np.newaxis, :] * Gamma[np.newaxis, :, :]).reshape(-1, self.n)
+                G += [gamma * self.transition_matrices()[a].dot(projected.T).T.reshape(self.z, len(Gamma), self.n)]
+
+            if algorithm == 'pbvi':
+                Gamma, pi = backup(G, beliefs)[:2]
+
+            elif algorithm == 'perseus':
+                current = (beliefs.dot(Gamma.T)).max(axis=1)
+                remaining = np.ones(len(beliefs), dtype=bool)
+
+                GammaPrime = list()
+                piPrime = list()
+
+                while np.any(remaining):
+                    i = rng.choice(np.flatnonzero(remaining))
+                    alpha, action, value = backup(G, beliefs[i:i + 1])
+
+                    if value[0] < current[i]:
+                        k = np.argmax(Gamma.dot(beliefs[i]))
+                        alpha, action = Gamma[k:k + 1], pi[k:k + 1]
+
+                    GammaPrime += [alpha[0]]
+                    piPrime += [action[0]]
+
+                    remaining &= (beliefs.dot(alpha[0]) < current)
+                    remaining[i] = False
+
+                Gamma, pi = np.array(GammaPrime), np.array(piPrime)
+
+            else:
+                raise Exception("Unknown algorithm '%s'." % (algorithm))
+
+            # Only keep one copy of identical alpha-vectors.
+            Gamma, unique = np.unique(Gamma, axis=0, return_index=True)
+            pi = pi[unique]
+
+            valuesPrime = beliefs.dot(Gamma.T).max(axis=1)
+            residual = np.abs(valuesPrime - values).max(initial=0.0)
+            values = valuesPrime
+
+            if residual < epsilon:
+                break
+
+        timing = (time.time() - timing[0], time.process_time() - timing[1])
+
+        return Gamma, pi, timing
+
+    def solve_backward(self, maxBeliefs=200):
+        """ Solve the POMDP with finite-horizon backward induction over the time remaining. Since state[0]
+            strictly counts down until an absorbing state, the value at a belief with t time remaining only
+            depends on the beliefs with t - 1 remaining. Thus, we enumerate the beliefs reachable from the
+            belief points (Z and B) and from each initial ToC belief (t, h, "nop", 0), then perform one
+            point-based backup at each, from zero time remaining upwards. Each alpha-vector is computed over
+            all states, as the value of a conditional plan which is then followed by the worst possible
+            value, so it is a valid lower bound everywhere and exact at the beliefs it was backed up at.
+
+            In the worst case, the number of reachable beliefs grows exponentially with the time remaining,
+            since each step may branch on every action and observation. Thus, by default, only up to
+            maxBeliefs distinct beliefs are kept for each time remaining and set of possible states.
+
+            Parameters:
+                maxBeliefs  --  Optionally, the maximum number of beliefs for each time remaining and set of
+                                possible states. Default is 200. None means all reachable beliefs, so the
+                                values at them are exact, but time and memory may grow exponentially.
+
+            Returns:
+                Gamma   --  The alpha-vectors, an array with one row per alpha-vector.
+                pi      --  The corresponding actions for each alpha-vector.
+                timing  --  The (wall, CPU) time in seconds.
+        """
+
+        timing = (time.time(), time.process_time())
+
+        S = as_numpy_array(self.S, self.n * self.m * self.ns).reshape(self.n, self.m, self.ns)
+        T = as_numpy_array(self.T, self.n * self.m * self.ns).reshape(self.n, self.m, self.ns).astype(float)
+        O = as_numpy_array(self.O, self.m * self.n * self.z).reshape(self.m, self.n, self.z).astype(float)
+        R = as_numpy_array(self.R, self.n * self.m).reshape(self.n, self.m).astype(float)
+        gamma = float(self.gamma)
+
+        absorbing = np.all((S[:, :, 0] == np.arange(self.n)[:, np.newaxis]) & (T[:, :, 0] == 1.0), axis=1)
+        timeRemaining = np.array([state[0] if isinstance(state, tuple) else -1 for state in self.states])
+        numT = timeRemaining.max() + 1
+
+        # The absorbing states self-loop forever, and any other state is at least the worst value.
+        leaf = np.full(self.n, R.min() / (1.0 - gamma))
+        leaf[absorbing] = R[absorbing].max(axis=1) / (1.0 - gamma)
+
+        # Each layer holds the beliefs with t time remaining, grouped by the states they are over: a dict
+        # mapping the tuple of state indexes to a list of arrays, each with one belief per row.
+        layers = [dict() for t in range(numT)]
+
+        def add_beliefs(states, values):
+            t = timeRemaining[states[0]]
+            if t >= 0 and not np.any(absorbing[states]):
+                layers[t].setdefault(tuple(states), list()).append(values / values.sum(axis=1, keepdims=True))
+
+        def distinct_beliefs(t):
+            for states, values in layers[t].items():
+                values = np.unique(np.round(np.vstack(values), 12), axis=0)
+                if maxBeliefs is not None:
+                    values = values[:maxBeliefs]
+                layers[t][states] = [values]
+                yield np.array(states), values
+
+        Z = as_numpy_array(self.Z, self.r * self.rz).reshape(self.r, self.rz)
+        B = as_numpy_array(self.B, self.r * self.rz).reshape(self.r, self.rz)
+        for i in range(self.r):
+            valid = (Z[i] >= 0) & (B[i] > 0.0)
+            order = np.argsort(Z[i][valid])
+            add_beliefs(Z[i][valid][order], B[i][valid][order][np.newaxis, :].astype(float))
+
+        for t in range(numT):
+            states = np.array([s for s, state in enumerate(self.states) if isinstance(state, tuple) and \
+                                state[0] == t and state[2] == "nop" and state[3] == 0])
+            if len(states) > 0:
+                add_beliefs(states, np.ones((1, len(states))))
+
+        # Forward: successors of beliefs with t time remaining have t - 1 remaining (or are absorbing).
+        # For a group of beliefs over the same states, the successors are the same for all of them.
+        for t in reversed(range(1, numT)):
+            for states, values in list(distinct_beliefs(t)):
+                for a in range(self.m):
+                    successors = S[states, a, :].ravel()
+                    probabilities = (values[:, :, np.newaxis] * T[states, a, :][np.newaxis, :, :]).reshape(len(values), -1)
+
+                    for o in range(self.z):
+                        possible = (successors >= 0) & (O[a, successors, o] > 0.0)
+                        if not np.any(possible):
+                            continue
+
+                        statesPrime, inverse = np.unique(successors[possible], return_inverse=True)
+                        merge = np.zeros((len(inverse), len(statesPrime)))
+                        merge[np.arange(len(inverse)), inverse] = 1.0
+
+                        valuesPrime = (probabilities[:, possible] * O[a, successors[possible], o]).dot(merge)
+                        valuesPrime = valuesPrime[valuesPrime.sum(axis=1) > 0.0]
+                        if len(valuesPrime) > 0:
+                            add_beliefs(statesPrime, valuesPrime)
+
+        # Backward: one point-based backup at each belief, using the alpha-vectors of the next layer.
+        Gamma = list()
+        pi = list()
+
+        GammaPrime = leaf[np.newaxis, :]
+
+        for t in range(numT):
+            # The candidate alpha-vectors, and the index of each one's (action, next alpha-vectors) key.
+            keys = list()
+            vectors = list()
+            alphas = dict()
+            used = set()
+
+            for states, values in distinct_beliefs(t):
+                bestValues = np.full(len(values), -np.inf)
+                bestAlphas = np.zeros(len(values), dtype=int)
+
+                for a in range(self.m):
+                    successors = S[states, a, :].ravel()
+                    valid = (successors >= 0)
+                    probabilities = (values[:, :, np.newaxis] * T[states, a, :][np.newaxis, :, :]).reshape(len(values), -1)
+
+                    # The best next alpha-vector for each observation, at each (unnormalized) successor belief.
+                    # This is done in chunks of beliefs to bound the memory of the intermediate array.
+                    weights = probabilities[:, valid][:, :, np.newaxis] * O[a, successors[valid], :][np.newaxis, :, :]
+                    j = np.vstack([np.argmax(np.einsum('klz,jl->kzj', weights[i:i + 1024], GammaPrime[:, successors[valid]]), axis=2)
+                                   for i in range(0, len(values), 1024)])
+
+                    # Each distinct choice of next alpha-vectors is one candidate alpha-vector, computed once.
+                    # Rows of j are encoded as integers when possible, since that is much faster to make unique.
+                    if float(len(GammaPrime)) ** self.z < 2.0**62:
+                        codes = j.dot(len(GammaPrime) ** np.arange(self.z, dtype=np.int64))
+                        codes, first, inverse = np.unique(codes, return_index=True, return_inverse=True)
+                        jRows = j[first]
+                    else:
+                        jRows, inverse = np.unique(j, axis=0, return_inverse=True)
+                    inverse = inverse.ravel()
+
+                    candidates = list()
+                    for jRow in jRows:
+                        key = (a, tuple(jRow))
+                        if key not in alphas:
+                            W = (O[a] * GammaPrime[jRow, :].T).sum(axis=1)
+                            alphas[key] = len(keys)
+                            keys += [key]
+                            vectors += [R[:, a] + gamma * (T[:, a, :] * W[S[:, a, :]]).sum(axis=1)]
+                        candidates += [alphas[key]]
+                    candidates = np.array(candidates)[inverse]
+
+                    actionValues = (np.array([vector[states] for vector in vectors])[candidates] * values).sum(axis=1)
+                    improved = (actionValues > bestValues)
+                    bestValues[improved] = actionValues[improved]
+                    bestAlphas[improved] = candidates[improved]
+
+                used.update(bestAlphas.tolist())
+
+            if len(used) > 0:
+                used = sorted(used)
+                GammaPrime = np.array(vectors)[used]
+                Gamma += [GammaPrime]
+                pi += [keys[i][0] for i in used]
+
+        if len(Gamma) == 0:
+            Gamma = [leaf[np.newaxis, :]]
+            pi = [0]
+
+        Gamma = np.vstack(Gamma)
+        pi = np.array(pi, dtype=int)
+
+        timing = (time.time() - timing[0], time.process_time() - timing[1])
+
+        return Gamma, pi, timing
+
+    def digest(self, **settings):
+        """ Compute a content hash of this POMDP's arrays and parameters, e.g., to use as a ToCCache key.
+
+            Parameters:
+                settings    --  Optionally, any solver settings which should also distinguish the hash.
+
+            Returns:
+                The hexadecimal digest.
+        """
+
+        return digest(as_numpy_array(self.S, self.n * self.m * self.ns),
+                      as_numpy_array(self.T, self.n * self.m * self.ns),
+                      as_numpy_array(self.O, self.m * self.n * self.z),
+                      as_numpy_array(self.R, self.n * self.m),
+                      as_numpy_array(self.Z, self.r * self.rz),
+                      as_numpy_array(self.B, self.r * self.rz),
+                      self.n, self.m, self.z, self.ns, self.r, self.rz, self.k,
+                      float(self.gamma), self.horizon, sorted(settings.items()))
+
+    def solve_cached(self, cache=None, **settings):
+        """ Solve the POMDP, reusing the policy from the cache if an identical POMDP was already solved
+            with identical settings. Otherwise, solve it and add the policy to the cache.
+
+            Parameters:
+                cache       --  The ToCCache. Default is None, meaning always solve.
+                settings    --  Any keyword arguments for solve, e.g., algorithm.
+
+            Returns:
+                Gamma   --  The alpha-vectors.
+                pi      --  The corresponding actions for each alpha-vector.
+                timing  --  The timing from solve. If the policy was in the cache, then this is the timing of
+                            the solve that originally computed it.
+        """
+
+        if cache is None:
+            return self.solve(**settings)
+
+        key = "policy_%s" % (self.digest(**settings))
+
+        # Entries cached without their timing are solved again, which replaces them.
+        policy = cache.get(key)
+        if policy is not None and 'timing' in policy:
+            return policy['Gamma'], policy['pi'], tuple(float(t) for t in policy['timing'])
+
+        Gamma, pi, timing = self.solve(**settings)
+        cache.put(key, {'Gamma': np.array(Gamma), 'pi': np.array(pi), 'timing': np.array(timing, dtype=float)})
+
+        return Gamma, pi, timing
+
+    def save(self, filename):
+        """ Save the POMDP, including its states, actions, and observations, to a binary (uncompressed
+            numpy .npz) file. This is intended for reusing a built (and expanded) POMDP via load.
+
+            Parameters:
+                filename    --  The name of the file to save. The .npz extension is added if missing.
+        """
+
+        metadata = {'states': self.states, 'actions': self.actions, 'observations': self.observations,
+                    'n': self.n, 'm': self.m, 'z': self.z, 'ns': self.ns, 'r': self.r, 'rz': self.rz,
+                    'k': self.k, 'gamma': float(self.gamma), 'horizon': self.horizon,
+                    'Rmax': float(self.Rmax), 'Rmin': float(self.Rmin)}
+
+        np.savez(npz_filename(filename),
+                 S=as_numpy_array(self.S, self.n * self.m * self.ns),
+                 T=as_numpy_array(self.T, self.n * self.m * self.ns),
+                 O=as_numpy_array(self.O, self.m * self.n * self.z),
+                 R=as_numpy_array(self.R, self.n * self.m),
+                 Z=as_numpy_array(self.Z, self.r * self.rz),
+                 B=as_numpy_array(self.B, self.r * self.rz),
+                 metadata=np.array(json.dumps(metadata)))
+
+    def load(self, filename):
+        """ Load a POMDP from a binary file created by save.
+
+            Parameters:
+                filename    --  The name of the file to load. The .npz extension is added if missing.
+        """
+
+        with np.load(npz_filename(filename)) as data:
+            metadata = json.loads(str(data['metadata']))
+
+            self.states = [tuple(state) if isinstance(state, list) else state for state in metadata['states']]
+            self.actions = metadata['actions']
+            self.observations = metadata['observations']
+
+            self._create_indexes()
+
+            self.n = metadata['n']
+            self.m = metadata['m']
+            self.z = metadata['z']
+            self.ns = metadata['ns']
+            self.r = metadata['r']
+            self.rz = metadata['rz']
+            self.k = metadata['k']
+            self.gamma = metadata['gamma']
+            self.horizon = metadata['horizon']
+            self.Rmax = metadata['Rmax']
+            self.Rmin = metadata['Rmin']
+
+            self.S = as_nova_array(data['S'], np.intc)
+            self.T = as_nova_array(data['T'], np.float32)
+            self.O = as_nova_array(data['O'], np.float32)
+            self.R = as_nova_array(data['R'], np.float32)
+            self.Z = as_nova_array(data['Z'], np.intc)
+            self.B = as_nova_array(data['B'], np.float32)
+
 
 if __name__ == "__main__":
     print("Performing ToCPOMDP Unit Test...")
@@ -20,8 +20,14 @@
     CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 
+import numpy as np
+import scipy.sparse as sparse
+import scipy.sparse.csgraph as csgraph
 import itertools as it
-import ctypes as ct
+import multiprocessing as mp
+import inspect
+import json
+import time
 
 import os
 import sys
@@ -31,15 +37,40 @@ thisFilePath = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(thisFilePath)
 from additional_functions import *
 
-sys.path.append(os.path.join(thisFilePath, "..", "..", "nova", "python"))
-from nova.mdp import *
-from nova.pomdp import *
-
+# This also provides nova's MDP, or a plain stand-in if nova is unavailable.
 from toc import *
 from tocpomdp import *
 from tocpath import *
 
 
+# The ToC SSP of each worker process computing rho, inherited read-only from the parent when it forks.
+_rhoWorkerToCSSP = None
+
+
+def _initialize_rho_worker(tocssp):
+    """ Initialize a worker process for computing rho.
+
+        Parameters:
+            tocssp  --  The ToC SSP with its ToC POMDPs and their policies.
+    """
+
+    global _rhoWorkerToCSSP
+    _rhoWorkerToCSSP = tocssp
+
+
+def _compute_rho_worker(task):
+    """ Compute one rho in a worker process.
+
+        Parameters:
+            task    --  The arguments to ToCSSP._compute_rho, with the random seed last.
+
+        Returns:
+            The 3-array of rho and the width of its confidence interval.
+    """
+
+    return _rhoWorkerToCSSP._compute_rho(*task[:-1], rng=np.random.default_rng(task[-1]))
+
+
 class ToCSSP(MDP):
     """ A class which models the ToC SSP problem. """
 
@@ -51,12 +82,56 @@ class ToCSSP(MDP):
         self.states = list()
         self.actions = list()
 
+        # The index of each state and action, for O(1) lookups instead of list.index.
+        self.statesIndex = dict()
+        self.actionsIndex = dict()
+
         self.toc = None
         self.tocpomdp = None
         self.tocpomdpGamma = None
         self.tocpomdppi = None
 
-    def _compute_rho(self, bfa, bfhata, timeRemaining, numIterations=25):
+        # The width of the confidence interval of each sampled rho, by time remaining, actor, and desired actor.
+        self.rhoWidth = None
+
+        # The dense vertex index of each state.
+        self.stateVertexes = None
+
+        # The admissible heuristic for LAO*, i.e., a lower bound on the cost from each state to the goal.
+        self.heuristic = None
+
+        # The cumulative transition table for sampling, created on demand.
+        self.transitionCumulative = None
+
+    def _create_indexes(self):
+        """ Create the dicts mapping each state and action to its index. """
+
+        self.statesIndex = {state: s for s, state in enumerate(self.states)}
+        self.actionsIndex = {action: a for a, action in enumerate(self.actions)}
+
+        # The dense vertex index of each state, which follows the ToC Path's (with "vf" last).
+        vertexesIndex = dict()
+        for state in self.states:
+            vertexesIndex.setdefault(state[0], len(vertexesIndex))
+        self.stateVertexes = np.array([vertexesIndex[state[0]] for state in self.states], dtype=int)
+
+        self.transitionCumulative = None
+
+    def transition_cumulative(self):
+        """ Get the cumulative transition probabilities over successors, created from T on the first call.
+
+            Returns:
+                The n-by-m-by-ns array of cumulative T(s, a, S(s, a, i)), for use with sample_cumulative.
+        """
+
+        if self.transitionCumulative is None:
+            T = as_numpy_array(self.T, self.n * self.m * self.ns).reshape(self.n, self.m, self.ns)
+            self.transitionCumulative = cumulative_table(T)
+
+        return self.transitionCumulative
+
+    def _compute_rho(self, bfa, bfhata, timeRemaining, numIterations=25, exact=False, targetWidth=None,
+                     maxIterations=10000, rng=None):
         """ Compute the probabilities of reaching terminal `end result' states, following Equations 14 and 15.
 
             Parameters:
@@ -64,9 +139,20 @@ class ToCSSP(MDP):
                 bfhata          --  The desired actor.
                 timeRemaining   --  How much time is allotted to TOC.
                 numIterations   --  Optionally specify the number of iterations used to sample rho. Default is 25.
+                exact           --  Optionally compute rho exactly over the belief tree instead of sampling it.
+                                    Default is False.
+                targetWidth     --  Optionally, keep sampling (doubling the iterations) until the 95% confidence
+                                    interval of each probability is at most this wide. Default is None, meaning
+                                    only sample numIterations.
+                maxIterations   --  Optionally specify the maximum number of iterations when targetWidth is given.
+                                    Default is 10000.
+                rng             --  Optionally, the numpy.random.Generator used to sample rho. Default is None,
+                                    meaning one seeded from the random module.
 
             Return:
-                A 3-array corresponding to: [Pr(human), Pr(vehicle), Pr(side of road)].
+                rho     --  A 3-array corresponding to: [Pr(human), Pr(vehicle), Pr(side of road)].
+                width   --  The widest 95% (Wilson score) confidence interval of the sampled probabilities, or 0.0
+                            if rho is exact.
         """
 
         calA = ["human", "vehicle", "side of road"]
@@ -87,62 +173,140 @@ class ToCSSP(MDP):
         if bfa == "side of road":
             if bfhata != "human":
                 rho[2] = 1.0
-                return rho
+                return rho, 0.0
 
         # Equation 15.
         elif bfa != "side of road":
             if bfhata in [bfa, "side of road"]:
                 rho[bfhataIndex] = 1.0
-                return rho
+                return rho, 0.0
 
         # Now ensure a valid time remaining.
         timeRemaining = min(len(toc.T) - 1, timeRemaining)
 
-        numSuccess = 0
-        numFailure = 0
-        numAborted = 0
-
-        for k in range(numIterations):
-            validInitialStates = [tocpomdp.states.index((timeRemaining, h, "nop", 0)) for h in toc.H]
-            b = np.array([1.0 / len(validInitialStates) * (i in validInitialStates) for i in range(tocpomdp.n)])
-            s = rnd.choice(validInitialStates)
-
-            for t in range(timeRemaining + 1):
-                a, v = take_action(tocpomdp, Gamma, pi, b)
-                sp = transition_state(tocpomdp, s, a)
-                o = make_observation(tocpomdp, a, sp)
-                b = update_belief(tocpomdp, b, a, o)
-                s = sp
-
-            if s == tocpomdp.states.index("success"):
-                numSuccess += 1
-            elif s == tocpomdp.states.index("failure"):
-                numFailure += 1
-            elif s == tocpomdp.states.index("aborted"):
-                numAborted += 1
+        validInitialStates = [tocpomdp.statesIndex[(timeRemaining, h, "nop", 0)] for h in toc.H]
+        b = np.zeros(tocpomdp.n)
+        b[validInitialStates] = 1.0 / len(validInitialStates)
+
+        terminals = [tocpomdp.statesIndex[e] for e in ["success", "failure", "aborted"]]
+
+        if exact:
+            outcomes = exact_outcomes(tocpomdp, Gamma, pi, b, timeRemaining + 1)
+            width = 0.0
+        else:
+            if rng is None:
+                rng = np.random.default_rng(rnd.getrandbits(64))
+
+            counts = np.zeros(tocpomdp.n)
+            total = 0
+            batchSize = numIterations
+
+            while True:
+                # Simulate all the iterations in lockstep, each starting at a random valid initial state.
+                counts += simulate_batch(tocpomdp, Gamma, pi, rng.choice(validInitialStates, size=batchSize),
+                                         b, timeRemaining + 1, rng)
+                total += batchSize
+
+                # The Wilson score interval, which unlike the normal approximation is not empty at 0 or 1.
+                z = 1.96
+                p = counts[terminals] / total
+                width = float(np.max(2.0 * z / (1.0 + z**2 / total)
+                                     * np.sqrt(p * (1.0 - p) / total + z**2 / (4.0 * total**2))))
+
+                if targetWidth is None or width <= targetWidth or total >= maxIterations:
+                    break
+
+                batchSize = min(total, maxIterations - total)
+
+            outcomes = counts / float(total)
+
+        probSuccess, probFailure, probAborted = outcomes[terminals]
 
         # Equation 14.
         if bfa == "side of road":
             # Note: bfhata = "human" (lambda) here because otherwise it would
             # have returned already in the beginning...
-            rho[0] = float(numSuccess) # rho[0] == rho[a' = human]
-            rho[2] = float(numFailure + numAborted) # rho[2] = rho[a' = side of road]
-            rho /= float(numIterations)
-            return rho
+            rho[0] = probSuccess # rho[0] == rho[a' = human]
+            rho[2] = probFailure + probAborted # rho[2] = rho[a' = side of road]
+            return rho, width
 
         # Equation 15.
         elif bfa != "side of road":
             # Note: bfhata not in [bfa, "side of road"] here because otherwise it would
             # have returned already in the beginning...
-            rho[bfhataIndex] = float(numSuccess)
-            rho[bfaIndex] = float(numFailure)
-            rho[2] = float(numAborted) # rho[2] = rho[a' = side of road]
-            rho /= float(numIterations)
-            return rho
+            rho[bfhataIndex] = probSuccess
+            rho[bfaIndex] = probFailure
+            rho[2] = probAborted # rho[2] = rho[a' = side of road]
+            return rho, width
+
+        return None, None
+
+    def _compute_rho_table(self, calA, cache=None, exact=False, numIterations=25, targetWidth=None,
+                           maxIterations=10000, workers=None):
+        """ Compute rho for every time remaining, current actor, and desired actor. Since rho only depends on
+            the ToC POMDPs and their policies (not on the path), the table is reused from the cache if possible.
+
+            Parameters:
+                calA            --  The actors.
+                cache           --  Optionally, the ToCCache. Default is None, meaning always compute.
+                exact           --  Optionally compute rho exactly instead of sampling it. Default is False.
+                numIterations   --  Optionally specify the number of iterations used to sample rho. Default is 25.
+                targetWidth     --  Optionally, the confidence interval width at which sampling each rho stops.
+                                    Default is None, meaning always sample numIterations.
+                maxIterations   --  Optionally specify the maximum number of iterations when targetWidth is given.
+                                    Default is 10000.
+                workers         --  Optionally, the number of processes over which to spread the computation.
+                                    Default is None, meaning all in this process.
+
+            Returns:
+                rho         --  The |T|-by-|calA|-by-|calA|-by-3 array of rho, indexed by time remaining, actor, and
+                                desired actor.
+                rhoWidth    --  The |T|-by-|calA|-by-|calA| array of the confidence interval width achieved by each.
+        """
+
+        key = None
 
-        return None
+        if cache is not None:
+            key = "rho_%s" % (digest(*[pomdp.digest() for pomdp in self.tocpomdp],
+                                     *[np.asarray(Gamma) for Gamma in self.tocpomdpGamma],
+                                     *[np.asarray(pi) for pi in self.tocpomdppi],
+                                     [list(toc.T) for toc in self.toc], calA, exact, numIterations,
+                                     targetWidth, maxIterations))
 
-    def create(self, toc, tocpomdp, path, controller=None):
+            table = cache.get(key)
+            if table is not None:
+                return table['rho'], table['rhoWidth']
+
+        tasks = list(it.product(self.toc[0].T, calA, calA))
+
+        # Each task gets its own random stream, so the table does not depend on the number of workers.
+        seeds = np.random.SeedSequence(rnd.getrandbits(64)).spawn(len(tasks))
+        tasks = [(bfa, bfhata, timeRemaining, numIterations, exact, targetWidth, maxIterations, seed)
+                 for (timeRemaining, bfa, bfhata), seed in zip(tasks, seeds)]
+
+        if workers is None or workers <= 1:
+            rho = [self._compute_rho(*task[:-1], rng=np.random.default_rng(task[-1])) for task in tasks]
+        else:
+            # Create the arrays used by the simulation before forking, so that the workers share them read-only.
+            for pomdp in self.tocpomdp:
+                pomdp.transition_matrices()
+                pomdp.observation_table()
+                pomdp.transition_cumulative()
+                pomdp.observation_cumulative()
+
+            with mp.get_context("fork").Pool(workers, initializer=_initialize_rho_worker, initargs=(self,)) as pool:
+                rho = pool.map(_compute_rho_worker, tasks)
+
+        rhoWidth = np.array([width for r, width in rho]).reshape(len(self.toc[0].T), len(calA), len(calA))
+        rho = np.array([r for r, width in rho]).reshape(len(self.toc[0].T), len(calA), len(calA), 3)
+
+        if cache is not None:
+            cache.put(key, {'rho': rho, 'rhoWidth': rhoWidth})
+
+        return rho, rhoWidth
+
+    def create(self, toc, tocpomdp, path, controller=None, cache=None, exact=False, targetWidth=None,
+               workers=None):
         """ Create the MDP SSP given the ToC's path planning problem and the ToC problem itself.
 
             Parameters:
@@ -151,6 +315,15 @@ class ToCSSP(MDP):
                 path        --  The weighted directed graph: (V, E, w, v0, vg).
                 controller  --  Optionally restrict the ToC SSP to only "human" or "vehicle" control.
                                 Default is None, meaning both are included.
+                cache       --  Optionally, a ToCCache so that the POMDP policies and rho are only computed
+                                once, across calls and (if it has a directory) across runs. Default is None.
+                exact       --  Optionally compute rho exactly instead of sampling it, so the ToC SSP is
+                                deterministic. Default is False.
+                targetWidth --  Optionally, keep sampling each rho until its 95% confidence interval is at most
+                                this wide (or up to 10000 iterations). The achieved widths are stored in rhoWidth.
+                                Default is None, meaning a fixed 25 iterations.
+                workers     --  Optionally, the number of processes over which to spread computing rho.
+                                Default is None, meaning all in this process.
         """
 
         self.toc = toc
@@ -159,7 +332,7 @@ class ToCSSP(MDP):
         self.tocpomdpGamma = list()
         self.tocpomdppi = list()
         for pomdp in self.tocpomdp:
-            Gamma, pi, timing = pomdp.solve()
+            Gamma, pi, timing = pomdp.solve_cached(cache)
             self.tocpomdpGamma += [Gamma]
             self.tocpomdppi += [pi]
 
@@ -180,12 +353,12 @@ class ToCSSP(MDP):
         self.actions = list(it.product(D, calA))
         self.m = len(self.actions)
 
+        self._create_indexes()
+
         theta = {(v, d): None for v, d in it.product(V, D)}
         for v in path.V:
-            vEdges = [e for e in path.E if e[0] == v]
-            vEdges = sorted(vEdges, key=lambda z: z[1])
-            for dIndex, e in enumerate(vEdges):
-                theta[(v, D[dIndex])] = e[1]
+            for dIndex, vp in enumerate(sorted(path.successors[v])):
+                theta[(v, D[dIndex])] = vp
         for d in D:
             theta[("vf", d)] = "vf"
             theta[(path.vg, d)] = path.vg
@@ -194,175 +367,384 @@ class ToCSSP(MDP):
         self.theta = theta
 
         # Compute all the possible rho values, given all possible states (each having a different time to TOC).
-        rho = [[[self._compute_rho(bfa, bfhata, timeRemaining) for bfhata in calA] for bfa in calA] for timeRemaining in self.toc[0].T]
+        rho, self.rhoWidth = self._compute_rho_table(calA, cache=cache, exact=exact, targetWidth=targetWidth,
+                                                     workers=workers)
 
         # The maximum number of successor states is always bounded by 3, because
         # the uncertainty is only ever over the result of the ToC POMDP final
         # absorbing state. All other cases are deterministic.
         self.ns = 3
 
-        S = [[[int(-1) for sp in range(self.ns)] for a in range(self.m)] for s in range(self.n)]
-        T = [[[float(0.0) for sp in range(self.ns)] for a in range(self.m)] for s in range(self.n)]
-        for s, state in enumerate(self.states):
-            v = state[0]
-            bfa = state[1]
-            bfaIndex = calA.index(bfa)
-
-            for a, action in enumerate(self.actions):
-                d = action[0]
-                bfhata = action[1]
-                dIndex = D.index(d)
-                bfhataIndex = calA.index(bfhata)
-
-                e = (v, theta[(v, d)])
-                rho_s_bfhata = None
-                try:
-                    # This will only fail for e = theta returning a None for the impossible
-                    # action. This essentially handles the A(s) case. If this is the failure
-                    # vertex, then it doesn't matter what the weight is, since it will have
-                    # issues regardless being in a dead end.
-                    if v == "vf":
-                        rho_s_bfhata = rho[1][bfaIndex][bfhataIndex]
-                    else:
-                        timeRemaining = min(len(self.toc[0].T) - 1, int(path.w[e]))
-                        rho_s_bfhata = rho[timeRemaining][bfaIndex][bfhataIndex]
-                except KeyError:
-                    # We handle invalid actions by immediately transitioning to the failure
-                    # vertex "vf".
-                    S[s][a][0] = self.states.index(("vf", bfa))
-                    T[s][a][0] = 1.0
-                    continue
-
-                cur = 0
-
-                for sp, statePrime in enumerate(self.states):
-                    vp = statePrime[0]
-                    bfap = statePrime[1]
-                    bfapIndex = calA.index(bfap)
-
-                    if bfa == "human": # lambda
-                        # Equation 11.
-                        T_lambda = 0.0
-                        if vp == theta[(v, d)]:
-                            T_lambda = 1.0
-
-                        # Don't store a 0.0 state transition...
-                        if T_lambda != 0.0:
-                            # Equation 1.
-                            if bfa == bfhata and bfhata == bfap:
-                                S[s][a][cur] = sp
-                                T[s][a][cur] = T_lambda
-                                cur += 1
-                            elif bfa != bfhata:
-                                S[s][a][cur] = sp
-                                T[s][a][cur] = T_lambda * rho_s_bfhata[bfapIndex]
-                                cur += 1
-
-                    if bfa == "vehicle": # nu
-                        # Equation 12.
-                        T_nu = 0.0
-                        if e in path.Ec and vp == theta[(v, d)]:
-                            T_nu = 1.0
-                        elif (v, theta[(v, d)]) not in path.Ec and vp == "vf":
-                            T_nu = 1.0
-
-                        # Don't store a 0.0 state transition...
-                        if T_nu != 0.0:
-                            # Equation 1.
-                            if bfa == bfhata and bfhata == bfap:
-                                S[s][a][cur] = sp
-                                T[s][a][cur] = T_nu
-                                cur += 1
-                            elif bfa != bfhata:
-                                S[s][a][cur] = sp
-                                T[s][a][cur] = T_nu * rho_s_bfhata[bfapIndex]
-                                cur += 1
-
-                    if bfa == "side of road":
-                        # Equation 13.
-                        T_sigma = 0.0
-                        if vp == v:
-                            T_sigma = 1.0
-
-                        # Don't store a 0.0 state transition...
-                        if T_sigma != 0.0:
-                            # Equation 1.
-                            if bfa == bfhata and bfhata == bfap:
-                                S[s][a][cur] = sp
-                                T[s][a][cur] = T_sigma
-                                cur += 1
-                            elif bfa != bfhata:
-                                S[s][a][cur] = sp
-                                T[s][a][cur] = T_sigma * rho_s_bfhata[bfapIndex]
-                                cur += 1
-
-        array_type_nmns_int = ct.c_int * (self.n * self.m * self.ns)
-        array_type_nmns_float = ct.c_float * (self.n * self.m * self.ns)
-
-        self.S = array_type_nmns_int(*np.array(S).flatten())
-        self.T = array_type_nmns_float(*np.array(T).flatten())
-
-        wmin = min(path.w.values())
-        wmax = max(path.w.values())
+        # The vertexes are the dense indexes of the path's CSR graph, plus "vf" last.
+        nV, nA, nD = len(V), len(calA), len(D)
+        vf = nV - 1
+        vg = path.VIndex[path.vg]
+
+        # The CSR slots by source vertex and position, which is the direction.
+        sources = np.repeat(np.arange(len(path.V)), np.diff(path.offsets))
+        directions = np.arange(len(sources)) - path.offsets[sources]
+
+        # For each vertex and direction: the target vertex (-1 for an invalid action, i.e., no such edge),
+        # the time remaining index of rho, and if the vehicle is capable of driving the edge.
+        target = np.full((nV, nD), -1, dtype=int)
+        timeRemaining = np.ones((nV, nD), dtype=int)
+        capable = np.zeros((nV, nD), dtype=bool)
+
+        target[sources, directions] = path.targets
+        timeRemaining[sources, directions] = np.minimum(len(self.toc[0].T) - 1, path.weights.astype(int))
+        capable[sources, directions] = path.capable
+
+        target[vf, :] = vf
+        timeRemaining[vf, :] = 1
+
+        # Every direction at the goal stays there, which is only a valid action if it has a self-loop.
+        slot = path.edge_slot(vg, vg)
+        target[vg, :] = vg if slot >= 0 else -1
+        timeRemaining[vg, :] = min(len(self.toc[0].T) - 1, int(path.weights[slot])) if slot >= 0 else 1
+        capable[vg, :] = path.capable[slot] if slot >= 0 else False
+
+        # The successor vertex by vertex, actor, and direction (Equations 11, 12, and 13).
+        successor = np.empty((nV, nA, nD), dtype=int)
+        for bfaIndex, bfa in enumerate(calA):
+            if bfa == "human": # lambda
+                successor[:, bfaIndex, :] = target
+            elif bfa == "vehicle": # nu
+                successor[:, bfaIndex, :] = np.where(capable, target, vf)
+            elif bfa == "side of road": # sigma
+                successor[:, bfaIndex, :] = np.arange(nV)[:, np.newaxis]
+
+        # Index everything by (vertex, actor, direction, desired actor, successor index), which flattens to (s, a, sp).
+        vIndexes, bfaIndexes, dIndexes, bfhataIndexes = np.ix_(np.arange(nV), np.arange(nA),
+                                                               np.arange(nD), np.arange(nA))
+
+        S = np.full((nV, nA, nD, nA, self.ns), -1, dtype=np.intc)
+        T = np.zeros((nV, nA, nD, nA, self.ns), dtype=np.float32)
+
+        # Equation 1: keeping the actor is deterministic, while a ToC reaches each actor with probability rho.
+        keep = np.broadcast_to(bfaIndexes == bfhataIndexes, S.shape[:-1])
+        successorIndexes = np.broadcast_to((successor[:, :, :, np.newaxis] * nA)[..., np.newaxis], S.shape)
+
+        S[..., 0] = np.where(keep, successorIndexes[..., 0] + bfaIndexes, -1)
+        T[..., 0] = keep
+
+        transfer = rho[timeRemaining[vIndexes, dIndexes], bfaIndexes, bfhataIndexes]
+        for bfapIndex in range(nA):
+            S[..., bfapIndex] = np.where(keep, S[..., bfapIndex], successorIndexes[..., bfapIndex] + bfapIndex)
+            T[..., bfapIndex] = np.where(keep, T[..., bfapIndex], transfer[..., bfapIndex])
+
+        # We handle invalid actions by immediately transitioning to the failure vertex "vf".
+        invalid = np.broadcast_to((target < 0)[:, np.newaxis, :, np.newaxis], S.shape[:-1])
+        S[invalid] = -1
+        T[invalid] = 0.0
+        S[..., 0] = np.where(invalid, vf * nA + bfaIndexes, S[..., 0])
+        T[..., 0] = np.where(invalid, 1.0, T[..., 0])
+
+        S = S.reshape(self.n, self.m, self.ns)
+        T = T.reshape(self.n, self.m, self.ns)
+
+        self.S = as_nova_array(S, np.intc)
+        self.T = as_nova_array(T, np.float32)
+
+        wmin = path.weights.min()
+        wmax = path.weights.max()
 
         self.epsilon = 0.001
         self.gamma = 1.0
         self.horizon = 10000
         #self.horizon = max(10000, int(np.log(2.0 * (wmax - wmin) / (self.epsilon * (1.0 - self.gamma))) / np.log(1.0 / self.gamma)))
 
-        R = [[0.0 for a in range(self.m)] for s in range(self.n)]
-        for s, state in enumerate(self.states):
-            v = state[0]
-            bfa = state[1]
+        # Equation 16, plus the tie-breaking and handling invalid actions, by vertex and direction. The cost
+        # differs by actor only on the edges the vehicle would prefer to drive.
+        # These are single precision, as nova uses, so that R is built once and then handed over without a copy.
+        cost = np.full((nV, nD), (wmax + wmin * 2.0), dtype=np.float32)
+        costPreferred = np.zeros((nV, nD), dtype=np.float32)
 
-            for a, action in enumerate(self.actions):
-                d = action[0]
-                bfhata = action[1]
+        cost[sources, directions] = path.weights
+        costPreferred[sources, directions] = np.where(path.preferred, wmin, 0.0)
 
-                e = (v, theta[(v, d)])
+        cost[vf, :] = (wmax + wmin * 3.0)
+        cost[vg, :] = 0.0
+        costPreferred[vg, :] = 0.0
 
-                # Equation 16, plus the tie-breaking and handling invalid actions.
-                if v == path.vg:
-                    R[s][a] = 0.0
-                elif v == "vf":
-                    R[s][a] = (wmax + wmin * 3.0)
-                elif theta[(v, d)] == None:
-                    R[s][a] = (wmax + wmin * 2.0)
-                elif e in path.Ep and bfa != "vehicle":
-                    R[s][a] = (path.w[e] + wmin)
-                else:
-                    R[s][a] = path.w[e]
+        vehicle = np.array([bfa == "vehicle" for bfa in calA])
+        R = np.empty((nV, nA, nD, nA), dtype=np.float32)
+        R[...] = cost[:, np.newaxis, :, np.newaxis] + (costPreferred[:, np.newaxis, :, np.newaxis]
+                                                       * ~vehicle[np.newaxis, :, np.newaxis, np.newaxis])
+        R = R.reshape(self.n, self.m)
 
-        self.Rmax = np.array(R).max()
-        self.Rmin = np.array(R).min()
+        self.Rmax = R.max()
+        self.Rmin = R.min()
 
-        array_type_nm_float = ct.c_float * (self.n * self.m)
+        # Every step along an edge costs at least its weight, and staying costs at least zero, so the shortest
+        # distance to the goal is an admissible heuristic. It is shrunk slightly so that rounding the weights
+        # to single precision in R cannot break this. The vertexes which cannot reach the goal (including "vf")
+        # are only bounded by zero.
+        distances = np.zeros(nV)
+        distances[:len(path.V)] = path.shortest_distances(path.vg, reverse=True) * (1.0 - 1e-6)
+        distances[~np.isfinite(distances)] = 0.0
+        self.heuristic = distances[self.stateVertexes]
 
-        self.R = array_type_nm_float(*np.array(R).flatten())
+        self.R = as_nova_array(R, np.float32)
 
         # The initial state is the initial state in the graph, with the human driving, except
         # if the vehicle is the only one that can control the ToC SSP. Similarly for the goal.
         if controller is None:
-            self.s0 = self.states.index((path.v0, "human"))
+            self.s0 = self.statesIndex[(path.v0, "human")]
 
             self.ng = 3
-            array_type_ng_uint = ct.c_uint * (self.ng)
-
-            self.goals = array_type_ng_uint(*np.array([self.states.index((path.vg, bfa)) for bfa in calA]))
+            self.goals = as_nova_array([self.statesIndex[(path.vg, bfa)] for bfa in calA], np.uintc)
         elif controller == "human":
-            self.s0 = self.states.index((path.v0, "human"))
+            self.s0 = self.statesIndex[(path.v0, "human")]
 
             self.ng = 1
-            array_type_ng_uint = ct.c_uint * (self.ng)
-
-            self.goals = array_type_ng_uint(*np.array([self.states.index((path.vg, "human"))]))
+            self.goals = as_nova_array([self.statesIndex[(path.vg, "human")]], np.uintc)
         elif controller == "vehicle":
-            self.s0 = self.states.index((path.v0, "vehicle"))
+            self.s0 = self.statesIndex[(path.v0, "vehicle")]
 
             self.ng = 1
-            array_type_ng_uint = ct.c_uint * (self.ng)
+            self.goals = as_nova_array([self.statesIndex[(path.vg, "vehicle")]], np.uintc)
+
+    def solve(self, *args, **kwargs):
+        """ Solve the SSP. If backend is 'numpy', then this calls solve_numpy with the algorithm and heuristic,
+            ignoring nova's process settings. Otherwise, this is nova's solve, with the same arguments. Either
+            way, LAO* is given the heuristic computed by create, unless another one is given; for nova, this
+            is only if its solve accepts a heuristic. The backend is 'nova' by default, or 'numpy' if nova is
+            unavailable.
+
+            Returns:
+                V       --  The values of the states.
+                pi      --  The action index of each state. This is m, which is not a valid action, for the
+                            goals and for the states LAO* never expanded, so check for it before looking up
+                            actions[pi[s]].
+                timing  --  The timing information.
+        """
+
+        backend = kwargs.pop('backend', "nova" if novaAvailable else "numpy")
+        algorithm = kwargs.get('algorithm', args[0] if len(args) > 0 else 'vi')
 
-            self.goals = array_type_ng_uint(*np.array([self.states.index((path.vg, "vehicle"))]))
+        # LAO* uses the graph distance heuristic by default.
+        heuristic = kwargs.get('heuristic', None)
+        if algorithm == 'lao*' and heuristic is None and self.heuristic is not None:
+            heuristic = self.heuristic.tolist()
+
+        if backend == "numpy":
+            return self.solve_numpy(algorithm=algorithm, heuristic=heuristic)
+
+        # Older versions of nova do not take a heuristic, so only pass it on if this one does.
+        if heuristic is not None and 'heuristic' in inspect.signature(super().solve).parameters:
+            kwargs['heuristic'] = heuristic
+
+        return super().solve(*args, **kwargs)
+
+    def _bellman_update(self, states, V, S, T, R):
+        """ Perform a Bellman update of the cost-to-go at some states.
+
+            Parameters:
+                states  --  The array of state indexes.
+                V       --  The n-array of the current values.
+                S       --  The n-by-m-by-ns array of successors, with 0 in place of invalid (-1) successors.
+                T       --  The n-by-m-by-ns array of transition probabilities, with 0.0 for invalid successors.
+                R       --  The n-by-m array of costs.
+
+            Returns:
+                The updated values and the minimizing actions at the states.
+        """
+
+        Q = R[states] + float(self.gamma) * (T[states] * V[S[states]]).sum(axis=2)
+        a = Q.argmin(axis=1)
+
+        return Q[np.arange(len(states)), a], a
+
+    def solve_numpy(self, algorithm='vi', heuristic=None):
+        """ Solve the SSP with numpy, vectorizing each Bellman update over the states, instead of with nova.
+            Goals cost nothing forever. Iterations stop once the largest change is below epsilon, or after
+            horizon iterations.
+
+            Parameters:
+                algorithm   --  Either 'vi' for value iteration over all states, or 'lao*' for LAO*, which only
+                                expands and updates the states reachable from s0 following the greedy policy,
+                                updating all of them at once on each traversal, or 'tvi' for topological value
+                                iteration, which solves the strongly connected components of the transition graph
+                                in reverse topological order, each to convergence. The states which cannot reach a
+                                goal (e.g., "vf") would never converge, so these cost Rmax for the entire horizon,
+                                which bounds their value under value iteration. Default is 'vi'.
+                heuristic   --  Optionally, the n-array of admissible (lower bound) costs with which to initialize
+                                the values. Default is None, meaning all zeros.
+
+            Returns:
+                V       --  The n-array of values of the states.
+                pi      --  The n-array of the action of each state, or m for goals and states LAO* never expanded.
+                timing  --  The (wall, CPU) time in seconds.
+        """
+
+        timing = (time.time(), time.process_time())
+
+        S = as_numpy_array(self.S, self.n * self.m * self.ns).reshape(self.n, self.m, self.ns).astype(int)
+        T = as_numpy_array(self.T, self.n * self.m * self.ns).reshape(self.n, self.m, self.ns).astype(float)
+        R = as_numpy_array(self.R, self.n * self.m).reshape(self.n, self.m).astype(float)
+
+        T[S < 0] = 0.0
+        S[S < 0] = 0
+
+        goal = np.zeros(self.n, dtype=bool)
+        goal[as_numpy_array(self.goals, self.ng).astype(int)] = True
+
+        V = np.zeros(self.n) if heuristic is None else np.array(heuristic, dtype=float)
+        V[goal] = 0.0
+        pi = np.full(self.n, self.m, dtype=int)
+
+        if algorithm == 'vi':
+            states = np.flatnonzero(~goal)
+
+            for iteration in range(self.horizon):
+                Vp, pi[states] = self._bellman_update(states, V, S, T, R)
+                residual = np.abs(Vp - V[states]).max(initial=0.0)
+                V[states] = Vp
+
+                if residual < self.epsilon:
+                    break
+
+        elif algorithm == 'lao*':
+            expanded = np.zeros(self.n, dtype=bool)
+
+            for iteration in range(self.horizon):
+                # Find the best partial solution graph, following the greedy policy from the expanded states.
+                reached = np.zeros(self.n, dtype=bool)
+                reached[self.s0] = True
+                frontier = np.array([self.s0])
+
+                while len(frontier) > 0:
+                    frontier = frontier[expanded[frontier] & ~goal[frontier]]
+                    successors = S[frontier, pi[frontier], :][T[frontier, pi[frontier], :] > 0.0]
+                    frontier = np.unique(successors[~reached[successors]])
+                    reached[frontier] = True
+
+                # Expand its tips, then update all of its states.
+                tips = reached & ~expanded & ~goal
+                expanded |= tips
+
+                states = np.flatnonzero(reached & expanded & ~goal)
+                Vp, a = self._bellman_update(states, V, S, T, R)
+                residual = np.abs(Vp - V[states]).max(initial=0.0)
+                changed = np.any(a != pi[states])
+                V[states] = Vp
+                pi[states] = a
+
+                # Converged once the solution graph is closed, its values are stable, and its policy is too.
+                if not np.any(tips) and not changed and residual < self.epsilon:
+                    break
+
+        elif algorithm == 'tvi':
+            # The transition graph over all actions; goals are absorbing, so they have no outgoing edges.
+            nonzero = (T > 0.0) & ~goal[:, np.newaxis, np.newaxis]
+            rows = np.broadcast_to(np.arange(self.n)[:, np.newaxis, np.newaxis], S.shape)[nonzero]
+            cols = S[nonzero]
+
+            graph = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(self.n, self.n))
+            numComponents, labels = csgraph.connected_components(graph, directed=True, connection='strong')
+
+            # Only components with an internal edge (e.g., a self-loop) need more than a single backup.
+            internal = (labels[rows] == labels[cols])
+            cyclic = np.zeros(numComponents, dtype=bool)
+            cyclic[labels[rows[internal]]] = True
+
+            # The edges of the condensation DAG, and the number of unsolved components each one leads to.
+            dag = np.unique(np.column_stack((labels[rows[~internal]], labels[cols[~internal]])), axis=0)
+            remaining = np.bincount(dag[:, 0], minlength=numComponents)
+            solved = np.zeros(numComponents, dtype=bool)
+
+            # The cost of the states which cannot reach a goal grows with every iteration, so only their actions
+            # are computed. Their successors cannot reach a goal either, so these are entire components.
+            distances = csgraph.dijkstra(graph.T, indices=np.flatnonzero(goal), unweighted=True, min_only=True)
+            states = np.flatnonzero(~np.isfinite(distances))
+            if len(states) > 0:
+                V[states] = self.horizon * float(self.Rmax)
+                pi[states] = self._bellman_update(states, V, S, T, R)[1]
+
+                solved[labels[states]] = True
+                np.subtract.at(remaining, dag[solved[dag[:, 1]], 0], 1)
+
+            # Solve the components in reverse topological order. The components whose successors are all solved
+            # do not depend on each other, so each such level is solved to convergence at once.
+            while not np.all(solved):
+                level = ~solved & (remaining == 0)
+                states = np.flatnonzero(level[labels] & ~goal)
+
+                for iteration in range(self.horizon if np.any(cyclic[level]) else 1):
+                    Vp, pi[states] = self._bellman_update(states, V, S, T, R)
+                    residual = np.abs(Vp - V[states]).max(initial=0.0)
+                    V[states] = Vp
+
+                    if residual < self.epsilon:
+                        break
+
+                solved |= level
+                np.subtract.at(remaining, dag[level[dag[:, 1]], 0], 1)
+
+        else:
+            raise Exception("Unknown algorithm '%s'." % (algorithm))
+
+        timing = (time.time() - timing[0], time.process_time() - timing[1])
+
+        return V, pi, timing
+
+    def save(self, filename):
+        """ Save the SSP, including its states, actions, and theta, to a binary (uncompressed numpy .npz)
+            file. This is intended for reusing a built SSP via load; the ToC POMDPs are not saved.
+
+            Parameters:
+                filename    --  The name of the file to save. The .npz extension is added if missing.
+        """
+
+        metadata = {'states': self.states, 'actions': self.actions,
+                    'theta': [[v, d, vp] for (v, d), vp in self.theta.items()],
+                    'n': self.n, 'm': self.m, 'ns': self.ns, 'ng': self.ng, 's0': self.s0,
+                    'gamma': float(self.gamma), 'epsilon': float(self.epsilon), 'horizon': self.horizon,
+                    'Rmax': float(self.Rmax), 'Rmin': float(self.Rmin)}
+
+        np.savez(npz_filename(filename),
+                 S=as_numpy_array(self.S, self.n * self.m * self.ns),
+                 T=as_numpy_array(self.T, self.n * self.m * self.ns),
+                 R=as_numpy_array(self.R, self.n * self.m),
+                 goals=as_numpy_array(self.goals, self.ng),
+                 heuristic=self.heuristic if self.heuristic is not None else np.zeros(0),
+                 metadata=np.array(json.dumps(metadata)))
+
+    def load(self, filename):
+        """ Load an SSP from a binary file created by save.
+
+            Parameters:
+                filename    --  The name of the file to load. The .npz extension is added if missing.
+        """
+
+        with np.load(npz_filename(filename)) as data:
+            metadata = json.loads(str(data['metadata']))
+
+            self.states = [tuple(state) for state in metadata['states']]
+            self.actions = [tuple(action) for action in metadata['actions']]
+            self.theta = {(v, d): vp for v, d, vp in metadata['theta']}
+
+            self._create_indexes()
+
+            self.n = metadata['n']
+            self.m = metadata['m']
+            self.ns = metadata['ns']
+            self.ng = metadata['ng']
+            self.s0 = metadata['s0']
+            self.gamma = metadata['gamma']
+            self.epsilon = metadata['epsilon']
+            self.horizon = metadata['horizon']
+            self.Rmax = metadata['Rmax']
+            self.Rmin = metadata['Rmin']
+
+            self.S = as_nova_array(data['S'], np.intc)
+            self.T = as_nova_array(data['T'], np.float32)
+            self.R = as_nova_array(data['R'], np.float32)
+            self.goals = as_nova_array(data['goals'], np.uintc)
+
+            self.heuristic = None
+            if 'heuristic' in data.files and len(data['heuristic']) == self.n:
+                self.heuristic = data['heuristic']
 
 
 if __name__ == "__main__":
@@ -408,5 +790,16 @@ if __name__ == "__main__":
     print(V)
     print(pi.tolist())
 
+    print("Checking the numpy LAO* policy... ", end='')
+    sys.stdout.flush()
+
+    # Goals and the states LAO* never expanded have no action, which is marked with m.
+    V, pi, timing = tocssp.solve(algorithm='lao*', backend='numpy')
+    goals = as_numpy_array(tocssp.goals, tocssp.ng).astype(int)
+
+    assert np.all((pi >= 0) & (pi <= tocssp.m))
+    assert np.all(pi[goals] == tocssp.m)
+    assert tocssp.s0 in goals or pi[tocssp.s0] < tocssp.m
+
     print("Done.")
 